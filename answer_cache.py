@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+from atomic_file import atomic_write
+
+
+def normalize_context(context):
+    return " ".join(context.split())
+
+
+class AnswerCache:
+    def __init__(
+        self, cache_dir="./cache/answers", max_entries=1024, ttl=7 * 24 * 3600, max_disk_entries=65536
+    ):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, spec_hash, context, template_version, question):
+        digest = hashlib.sha256()
+        for part in (spec_hash, normalize_context(context), template_version, question):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def path(self, spec_hash, key):
+        return os.path.join(self.cache_dir, spec_hash, f"{key}.json")
+
+    def get(self, spec_hash, context, template_version, question):
+        key = self.key(spec_hash, context, template_version, question)
+
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if not self.expired(entry):
+                    self.memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry["answer"]
+                del self.memory[key]
+
+        path = self.path(spec_hash, key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            entry = None
+
+        if entry is not None and self.expired(entry):
+            self.remove(path)
+            entry = None
+
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.disk_hits += 1
+            self.remember(key, entry)
+            return entry["answer"]
+
+    def put(self, spec_hash, context, template_version, question, answer):
+        key = self.key(spec_hash, context, template_version, question)
+        entry = {
+            "spec_hash": spec_hash,
+            "question": question,
+            "answer": answer,
+            "created_at": time.time(),
+        }
+
+        atomic_write(self.path(spec_hash, key), json.dumps(entry))
+
+        with self.lock:
+            self.remember(key, entry)
+
+        self.evict()
+
+    def invalidate(self, spec_hash):
+        with self.lock:
+            for key in [k for k, v in self.memory.items() if v["spec_hash"] == spec_hash]:
+                del self.memory[key]
+        shutil.rmtree(os.path.join(self.cache_dir, spec_hash), ignore_errors=True)
+
+    def track(self, spec_url, spec_hash):
+        # Answers for the spec a URL used to serve can never be hit again once
+        # its content changes, so they are dropped as soon as we notice.
+        path = os.path.join(self.cache_dir, "urls.json")
+        with self.lock:
+            try:
+                with open(path) as f:
+                    urls = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                urls = {}
+
+            previous_hash = urls.get(spec_url)
+            if previous_hash == spec_hash:
+                return
+
+            urls[spec_url] = spec_hash
+            atomic_write(path, json.dumps(urls))
+
+        if previous_hash and previous_hash not in urls.values():
+            self.invalidate(previous_hash)
+
+    def evict(self):
+        # Answers are written once, so a file's mtime is when it was
+        # created. Expired ones go first, then the oldest until at most
+        # max_disk_entries are left.
+        entries = []
+        for spec_dir in os.scandir(self.cache_dir):
+            if not spec_dir.is_dir():
+                continue
+            for entry in os.scandir(spec_dir.path):
+                if entry.name.endswith(".json"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        # Evicted or invalidated by a concurrent job.
+                        continue
+                    entries.append((stat.st_mtime, entry.path))
+
+        entries.sort()
+        now = time.time()
+        excess = len(entries) - self.max_disk_entries
+        for i, (mtime, path) in enumerate(entries):
+            if i >= excess and (self.ttl is None or now - mtime <= self.ttl):
+                break
+            self.remove(path)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def expired(self, entry):
+        return self.ttl is not None and time.time() - entry["created_at"] > self.ttl
+
+    def remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self.memory),
+            }
@@ -1,9 +1,16 @@
-from main import main
+import os
+
+import constants
+import metrics
+from main import main, answer_cache, fetch_spec, get_catalog, index_cache
+from jobs import JobQueue
 from flask import *
 from wtforms import *
 from wtforms.validators import AnyOf
 
 app = Flask(__name__)
+app.json.sort_keys = False
+job_queue = JobQueue(max_workers=4)
 
 class AnalysisForm(Form):
     data_format = StringField("Format", [AnyOf(["json", "yaml"])])
@@ -20,14 +27,113 @@ def index():
         return render_template("index.html")
 
     elif request.method == "POST" and form.validate():
-        return render_template(
-            "answers.html",
-            query_answers=main(
-                form.data_format.data,
-                form.spec_url.data,
-                form.audience.data,
-                form.use_cases.data,
-                form.comments.data,
+        job_key = (
+            form.spec_url.data.strip(),
+            constants.create_business_context(
+                form.audience.data.strip(),
+                form.use_cases.data.strip(),
+                form.comments.data.strip(),
             ),
         )
-# todo: deploy to fly
\ No newline at end of file
+        # ?profile=1 dumps cProfile and tracemalloc reports for this run.
+        profile_dir = None
+        if request.args.get("profile"):
+            profile_dir = os.environ.get("PROFILE_DIR", "./cache/profiles")
+            job_key = job_key + ("profile",)
+        job = job_queue.submit(
+            job_key,
+            main,
+            form.data_format.data,
+            form.spec_url.data,
+            form.audience.data,
+            form.use_cases.data,
+            form.comments.data,
+            profile_dir=profile_dir,
+        )
+        return redirect(url_for("answers", job_id=job.id))
+
+@app.route("/answers/<job_id>")
+def answers(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+
+    return render_template(
+        "answers.html", job=job, query_answers=job.result, questions=constants.FAQ
+    )
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+
+    return jsonify(job.to_dict())
+
+@app.route("/cache/stats")
+def cache_stats():
+    return jsonify({"indexes": index_cache.stats(), "answers": answer_cache.stats()})
+
+@app.route("/catalog")
+def operation_catalog():
+    # Lists the operations of a spec without minifying it.
+    spec_url = request.args.get("spec_url")
+    if not spec_url:
+        abort(400)
+    open_api_spec, spec_hash = fetch_spec(spec_url)
+    if open_api_spec is None:
+        abort(404)
+
+    catalog = get_catalog(open_api_spec, spec_hash)
+    entries = catalog.list(method=request.args.get("method"), tag=request.args.get("tag"))
+    return jsonify([entry._asdict() for entry in entries])
+
+@app.route("/metrics")
+def prometheus_metrics():
+    gauges = {}
+    for prefix, stats in (("index_cache", index_cache.stats()), ("answer_cache", answer_cache.stats())):
+        for name, value in stats.items():
+            gauges[f"{prefix}_{name}"] = value
+    gauges["jobs_in_flight"] = len(job_queue.in_flight)
+    return Response(metrics.registry.render(gauges), mimetype="text/plain; version=0.0.4")
+
+@app.route("/metrics/runs")
+def metrics_runs():
+    return jsonify(metrics.registry.recent_runs())
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+
+    # Sent back by the browser on reconnect, anything but a position we
+    # gave out starts from the beginning.
+    try:
+        start = max(int(request.headers.get("Last-Event-ID", -1)) + 1, 0)
+    except ValueError:
+        start = 0
+
+    def stream():
+        position = start
+        while True:
+            position, events = job.wait_for_events(position, timeout=15)
+            if not events:
+                # Resumed after the last event of a finished job.
+                if job.finished_at is not None:
+                    return
+                yield ": keep-alive\n\n"
+                continue
+
+            for event, data in events:
+                yield f"id: {position}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+                position += 1
+                if event in ("done", "error"):
+                    return
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+# todo: deploy to fly
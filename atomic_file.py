@@ -0,0 +1,26 @@
+import os
+import tempfile
+
+
+def atomic_write(path, data):
+    # Writes to a temporary file next to path and renames it into place, so
+    # readers see the old file or the new one and never part of either. data
+    # is str, bytes, or a callable that writes to the open binary file. The
+    # temporary file is removed if anything fails.
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if callable(data):
+                data(f)
+            else:
+                f.write(data.encode("utf-8") if isinstance(data, str) else data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -0,0 +1,219 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import yaml
+
+import main
+import metrics
+from fetcher import SpecFetcher
+
+
+# Manifest entries need a spec URL or local path, everything else is
+# optional and defaults like the web form.
+JOB_OPTIONS = ("dedupe_schemas", "token_budget", "method", "tag", "lazy")
+
+
+def read_manifest(path):
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            entries = [json.loads(line) for line in f if line.strip()]
+        else:
+            entries = yaml.safe_load(f) or []
+
+    jobs = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"spec": entry}
+        job = {
+            "spec": entry["spec"],
+            "audience": entry.get("audience", ""),
+            "use_cases": entry.get("use_cases", ""),
+            "comments": entry.get("comments", ""),
+            **{option: entry[option] for option in JOB_OPTIONS if option in entry},
+        }
+        job["id"] = entry.get("id") or hashlib.sha256(
+            json.dumps(job, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:16]
+        jobs.append(job)
+    return jobs
+
+
+def read_finished(output_path):
+    # A crash can leave a half written last line, it is rerun like the
+    # failed and partial jobs.
+    finished = set()
+    try:
+        with open(output_path) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if result.get("status") == "done":
+                    finished.add(result["id"])
+    except FileNotFoundError:
+        pass
+    return finished
+
+
+class ResultWriter:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, result):
+        line = json.dumps(result) + "\n"
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def run_job(job, fetcher, models=None, profile_dir=None):
+    # main records into the job's own run, so its profile can be kept with
+    # the result.
+    start = time.perf_counter()
+    error = None
+    answers = None
+    with metrics.RunProfile("batch", profile_dir) as run:
+        try:
+            answers = main.main(
+                None,
+                job["spec"],
+                job["audience"],
+                job["use_cases"],
+                job["comments"],
+                models=models,
+                fetcher=fetcher,
+                run=run,
+                **{option: job[option] for option in JOB_OPTIONS if option in job},
+            )
+        except Exception as e:
+            logging.exception(f"Job {job['id']} ({job['spec']}) failed")
+            error = str(e)
+    profile = run.to_dict()
+
+    # Questions that failed come back empty, the job is rerun for them and
+    # the answers it already has are served from the answer cache.
+    status = "failed" if error else "done"
+    if answers is not None:
+        unanswered = [question for question, answer in answers.items() if not answer]
+        if unanswered:
+            status = "partial"
+            error = f"{len(unanswered)} of {len(answers)} questions unanswered"
+
+    return {
+        "id": job["id"],
+        "spec": job["spec"],
+        "status": status,
+        "answers": answers,
+        "error": error,
+        "seconds": time.perf_counter() - start,
+        "stages": profile["stages"],
+        "counts": profile["counts"],
+        "finished_at": time.time(),
+    }
+
+
+def throughput_report(results, seconds):
+    done = [result for result in results if result["status"] == "done"]
+    partial = [result for result in results if result["status"] == "partial"]
+    lines = [
+        f"{len(done)} done, {len(partial)} partial,"
+        f" {len(results) - len(done) - len(partial)} failed in {seconds:.1f}s,"
+        f" {len(done) / seconds * 60 if seconds else 0.0:.1f} specs/min"
+    ]
+
+    stages = {}
+    for result in results:
+        for path, entry in result["stages"].items():
+            totals = stages.setdefault(path, [0.0, 0.0])
+            totals[0] += entry["wall_seconds"]
+            totals[1] += entry["cpu_seconds"]
+    if stages:
+        total = sum(result["seconds"] for result in results)
+        lines.append(f"{'stage':<42} {'wall':>9} {'cpu':>9} {'per spec':>9} {'share':>6}")
+        for path, (wall, cpu) in sorted(stages.items()):
+            lines.append(
+                f"{path:<42} {wall:>8.2f}s {cpu:>8.2f}s {wall / len(results):>8.2f}s"
+                f" {wall / total * 100 if total else 0.0:>5.1f}%"
+            )
+    return "\n".join(lines)
+
+
+def run_batch(jobs, output_path, workers=4, models=None, profile_dir=None, on_result=None):
+    finished = read_finished(output_path)
+    pending = [job for job in jobs if job["id"] not in finished]
+    skipped = len(jobs) - len(pending)
+    if skipped:
+        logging.info(f"Skipping {skipped} jobs already done in {output_path}")
+
+    # Without models every job creates its own, the OpenAI ones cannot be
+    # shared between the workers' event loops.
+
+    # Jobs share the parsed spec cache and index cache of the main module.
+    # Their fetcher of their own reads local files in the manifest, the
+    # shared one keeps refusing them for the web app.
+    fetcher = SpecFetcher()
+    fetcher.allow_local_files = True
+
+    writer = ResultWriter(output_path)
+    results = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_job, job, fetcher, models, profile_dir) for job in pending]
+        for future in as_completed(futures):
+            result = future.result()
+            writer.write(result)
+            results.append(result)
+            if on_result is not None:
+                on_result(result, len(results), len(pending))
+
+    return results, skipped, time.perf_counter() - start
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Analyze every spec in a manifest and append the answers to a JSONL file."
+    )
+    parser.add_argument("manifest", help="YAML, JSON or JSONL list of specs and business contexts")
+    parser.add_argument("-o", "--output", default="results.jsonl")
+    parser.add_argument("-w", "--workers", type=int, default=4)
+    parser.add_argument("--profile-dir", help="dump cProfile and tracemalloc reports per job")
+    return parser.parse_args(argv)
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    jobs = read_manifest(args.manifest)
+
+    def on_result(result, done, total):
+        print(
+            f"[{done}/{total}] {result['status']} {result['spec']} in {result['seconds']:.1f}s",
+            flush=True,
+        )
+
+    results, skipped, seconds = run_batch(
+        jobs, args.output, args.workers, profile_dir=args.profile_dir, on_result=on_result
+    )
+    if skipped:
+        print(f"{skipped} jobs skipped, already done in {args.output}")
+    print(throughput_report(results, seconds))
+    return 0 if all(result["status"] == "done" for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
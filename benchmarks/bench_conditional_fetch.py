@@ -0,0 +1,133 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yaml
+
+from fetcher import SpecFetcher
+from benchmarks.synthetic_spec import make_spec
+
+
+class SpecServer(ThreadingHTTPServer):
+    # Serves one spec with an ETag and a Last-Modified, answering 304 when
+    # either validator still matches, and counts what it sent.
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SpecHandler)
+        self.full_responses = 0
+        self.not_modified = 0
+        self.versions = 0
+        self.set_content(b"")
+
+    def set_content(self, content):
+        # Last-Modified has whole seconds, each version is a second later.
+        self.versions += 1
+        self.content = content
+        self.etag = f'"{self.versions}"'
+        self.last_modified = formatdate(time.time() + self.versions, usegmt=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/openapi.yaml"
+
+
+class SpecHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        if (
+            self.headers.get("If-None-Match") == server.etag
+            or self.headers.get("If-Modified-Since") == server.last_modified
+        ):
+            server.not_modified += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        server.full_responses += 1
+        self.send_response(200)
+        self.send_header("ETag", server.etag)
+        self.send_header("Last-Modified", server.last_modified)
+        self.send_header("Content-Length", str(len(server.content)))
+        self.end_headers()
+        self.wfile.write(server.content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def timed_fetch(fetcher, url):
+    start = time.perf_counter()
+    fetched = fetcher.fetch(url)
+    return time.perf_counter() - start, fetched
+
+
+def main(n_paths=2000):
+    content = yaml.safe_dump(make_spec(n_paths=n_paths, n_schemas=200, seed=0)).encode("utf-8")
+    server = SpecServer()
+    server.set_content(content)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    cache_dir = tempfile.mkdtemp()
+    failed = []
+    try:
+        fetcher = SpecFetcher(cache_dir=cache_dir)
+        print(f"spec of {len(content) / 2**20:.1f} MiB")
+
+        seconds, first = timed_fetch(fetcher, server.url)
+        print(f"first fetch:      {seconds * 1000:7.1f}ms, status {first.status_code}")
+        if (first.status_code, first.from_cache, first.content) != (200, False, content):
+            failed.append("first fetch should download the spec")
+
+        seconds, again = timed_fetch(fetcher, server.url)
+        print(f"unchanged spec:   {seconds * 1000:7.1f}ms, status {again.status_code}")
+        if (again.status_code, again.from_cache, again.content) != (304, True, content):
+            failed.append("unchanged spec should come from the cache after a 304")
+        if again.sha256 != first.sha256:
+            failed.append("a 304 should keep the cached digest")
+
+        # Only Last-Modified left to match on.
+        server.etag = '"other"'
+        _, dated = timed_fetch(fetcher, server.url)
+        if dated.status_code != 304:
+            failed.append("If-Modified-Since alone should give a 304")
+
+        changed = content + b"\n# changed\n"
+        server.set_content(changed)
+        seconds, updated = timed_fetch(fetcher, server.url)
+        print(f"changed spec:     {seconds * 1000:7.1f}ms, status {updated.status_code}")
+        if (updated.status_code, updated.content) != (200, changed) or updated.sha256 == first.sha256:
+            failed.append("changed spec should be downloaded again")
+
+        # A cache too small for one spec evicts every blob it downloads, so
+        # the 304 for the next fetch has to fall back to a full one.
+        small = SpecFetcher(cache_dir=cache_dir, max_cache_bytes=len(content) - 1)
+        server.set_content(content)
+        small.fetch(server.url)
+        if os.listdir(os.path.join(cache_dir, "blobs")):
+            failed.append("blobs over max_cache_bytes should be evicted")
+        full_before = server.full_responses
+        seconds, evicted = timed_fetch(small, server.url)
+        print(f"evicted blob:     {seconds * 1000:7.1f}ms, status {evicted.status_code}")
+        if evicted.content != content or server.full_responses != full_before + 1:
+            failed.append("a 304 for an evicted blob should fetch the spec in full")
+
+        print(f"server sent {server.full_responses} full responses and {server.not_modified} 304s")
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(cache_dir)
+
+    for message in failed:
+        print(f"  failed: {message}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,61 @@
+import sys
+import time
+
+from minifier import OpenAPIMinifierService
+
+
+def dense_cyclic_spec(n_schemas, n_paths):
+    # Every schema refers to every other one, the worst case of specs like
+    # Stripe's where most objects link back to each other.
+    names = [f"Object{i}" for i in range(n_schemas)]
+    schemas = {
+        name: {
+            "type": "object",
+            "properties": {
+                "id": {"type": "string"},
+                **{other.lower(): {"$ref": f"#/components/schemas/{other}"} for other in names if other != name},
+            },
+        }
+        for name in names
+    }
+    paths = {
+        f"/v1/objects{p}": {
+            "get": {
+                "operationId": f"getObject{p}",
+                "responses": {
+                    "200": {
+                        "description": "OK",
+                        "content": {
+                            "application/json": {
+                                "schema": {"$ref": f"#/components/schemas/{names[p % n_schemas]}"}
+                            }
+                        },
+                    }
+                },
+            }
+        }
+        for p in range(n_paths)
+    }
+    return {
+        "openapi": "3.0.0",
+        "info": {"title": "Dense cycles", "version": "1.0.0"},
+        "servers": [{"url": "https://api.example.com"}],
+        "paths": paths,
+        "components": {"schemas": schemas},
+    }
+
+
+def main(n_paths=200, *sizes):
+    print(f"{'schemas':>8} {'paths':>6} {'seconds':>8} {'chars/endpoint':>15}")
+    for n_schemas in sizes or (8, 12, 20, 40):
+        spec = dense_cyclic_spec(n_schemas, n_paths)
+        start = time.perf_counter()
+        endpoints_by_method = OpenAPIMinifierService().run([spec])
+        seconds = time.perf_counter() - start
+        documents = [doc for docs in endpoints_by_method.values() for doc in docs]
+        chars = sum(len(doc.content) for doc in documents) / len(documents)
+        print(f"{n_schemas:>8} {n_paths:>6} {seconds:>7.2f}s {chars:>15.0f}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,78 @@
+import sys
+import tempfile
+
+from llama_index import ServiceContext
+from llama_index.ingestion import run_transformations
+from llama_index.llms import MockLLM
+
+from embedding import EmbeddingPipeline, FakeEmbedding
+from main import indexed_documents
+from minifier import OpenAPIMinifierService
+from benchmarks.synthetic_spec import make_spec
+
+
+def embed(documents, embed_model, checkpoint_dir=None, **pipeline_kwargs):
+    service_context = ServiceContext.from_defaults(llm=MockLLM(), embed_model=embed_model)
+    nodes = run_transformations(documents, service_context.transformations)
+    return EmbeddingPipeline(embed_model, **pipeline_kwargs).embed(nodes, checkpoint_dir)
+
+
+def report(name, stats):
+    print(
+        f"{name:<34} {stats.documents:>5} docs {stats.resumed:>5} resumed {stats.batches:>3} batches"
+        f" {stats.seconds:>6.2f}s {stats.documents_per_second:>7.1f} docs/s"
+        f" {stats.tokens_per_second:>8.0f} tokens/s"
+    )
+
+
+def main(n_paths=500, latency_ms=50):
+    documents = indexed_documents(OpenAPIMinifierService().run([make_spec(n_paths=n_paths)]))
+    latency = latency_ms / 1000
+    print(f"{len(documents)} documents, {latency_ms}ms per embedding request")
+
+    for concurrency in (1, 4, 8):
+        stats = embed(
+            documents,
+            FakeEmbedding(latency=latency, embed_batch_size=100),
+            batch_size=100,
+            concurrency=concurrency,
+        )
+        report(f"concurrency {concurrency}", stats)
+
+    stats = embed(
+        documents,
+        FakeEmbedding(latency=latency, embed_batch_size=25),
+        batch_size=100,
+        concurrency=8,
+        requests_per_minute=600,
+    )
+    report("concurrency 8, 600 requests/min", stats)
+
+    # A model that keeps failing stops the first build part way, the second
+    # build only embeds what the checkpoint is missing.
+    checkpoint_dir = tempfile.mkdtemp()
+    try:
+        embed(
+            documents,
+            FakeEmbedding(latency=latency, error_rate=0.2, seed=1, embed_batch_size=100),
+            checkpoint_dir,
+            batch_size=100,
+            concurrency=2,
+            retries=0,
+        )
+        print("first build did not fail")
+    except Exception as e:
+        print(f"first build failed: {e}")
+
+    stats = embed(
+        documents,
+        FakeEmbedding(latency=latency, embed_batch_size=100),
+        checkpoint_dir,
+        batch_size=100,
+        concurrency=4,
+    )
+    report("resumed from checkpoint", stats)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,191 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import asyncio
+import tempfile
+import statistics
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import yaml
+from llama_index import ServiceContext, VectorStoreIndex, load_index_from_storage
+
+import constants
+from embedding import EmbeddingPipeline, FakeEmbedding
+from fetcher import SpecFetcher
+from main import create_storage_context, embed_documents, indexed_documents, run_faq_queries
+from minifier import OpenAPIMinifierService
+from providers import FakeLLM, Models, create_models
+from spec_parser import load_spec
+from benchmarks.synthetic_spec import make_spec
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+STAGES = ("fetch", "parse", "minify", "embed", "index", "query")
+
+# A stage is reported as a regression when it is this much slower than the
+# median of the last runs recorded for the same spec and provider, and by
+# more than the noise of a few milliseconds.
+REGRESSION_RATIO = 1.25
+REGRESSION_MIN_SECONDS = 0.05
+REGRESSION_WINDOW = 5
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def corpus(directory):
+    # The checked in fixtures plus synthetic specs large enough to show up
+    # in the embed, index and query stages.
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.yaml"))):
+        shutil.copy(path, directory)
+    for n_paths in (100, 1000):
+        with open(os.path.join(directory, f"synthetic-{n_paths}.yaml"), "w") as f:
+            yaml.safe_dump(make_spec(n_paths=n_paths, n_schemas=n_paths // 5), f, sort_keys=False)
+    return sorted(os.listdir(directory))
+
+
+def run_pipeline(url, models, work_dir):
+    timings = {}
+
+    def timed(stage, fn):
+        start = time.perf_counter()
+        result = fn()
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    fetcher = SpecFetcher(cache_dir=os.path.join(work_dir, "specs"))
+    fetched = timed("fetch", lambda: fetcher.fetch(url))
+    spec = timed("parse", lambda: load_spec(fetched.content))
+    ep_by_method = timed("minify", lambda: OpenAPIMinifierService().run([spec]))
+
+    service_context = ServiceContext.from_defaults(llm=models.llm, embed_model=models.embed_model)
+    documents = indexed_documents(ep_by_method)
+    nodes = timed(
+        "embed",
+        lambda: embed_documents(
+            documents, service_context, EmbeddingPipeline(models.embed_model), None
+        ),
+    )
+
+    persist_dir = os.path.join(work_dir, "index")
+
+    def build_index():
+        index = VectorStoreIndex(
+            nodes, storage_context=create_storage_context(), service_context=service_context
+        )
+        index.storage_context.persist(persist_dir)
+        return load_index_from_storage(
+            create_storage_context(persist_dir), service_context=service_context
+        )
+
+    index = timed("index", build_index)
+
+    context = constants.create_business_context("developers", "integration", "")
+    query_engine = index.as_query_engine(
+        text_qa_template=constants.create_qa_template(
+            constants.primer_prompt, context, constants.openapi_format_instructions
+        ),
+    )
+    answers = timed("query", lambda: asyncio.run(run_faq_queries(query_engine, constants.FAQ)))
+
+    return timings, {
+        "documents": len(documents),
+        "answered": sum(1 for answer in answers.values() if answer),
+    }
+
+
+def read_history(path):
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def regressions(history, result):
+    previous = [
+        entry
+        for entry in history
+        if entry["spec"] == result["spec"] and entry["provider"] == result["provider"]
+    ][-REGRESSION_WINDOW:]
+    if not previous:
+        return {}
+
+    slower = {}
+    for stage in STAGES:
+        baseline = statistics.median(entry["timings"][stage] for entry in previous)
+        elapsed = result["timings"][stage]
+        if elapsed > baseline * REGRESSION_RATIO and elapsed - baseline > REGRESSION_MIN_SECONDS:
+            slower[stage] = elapsed / baseline if baseline else float("inf")
+    return slower
+
+
+def main(provider="fake", recording=None, history_path="./cache/bench_end_to_end.jsonl"):
+    if provider == "fake":
+        # Roughly the latency and throughput of a hosted model.
+        models = Models(
+            "fake",
+            FakeLLM(latency=0.2, tokens_per_second=200),
+            FakeEmbedding(latency=0.05, tokens_per_second=200000),
+        )
+    else:
+        models = create_models(provider, recording)
+
+    history = read_history(history_path)
+    fixtures_dir = tempfile.mkdtemp()
+    server = serve(fixtures_dir)
+    failed = []
+    try:
+        names = corpus(fixtures_dir)
+        print(f"{'spec':<22} " + " ".join(f"{stage:>8}" for stage in STAGES) + "    docs answered")
+        for name in names:
+            work_dir = tempfile.mkdtemp()
+            try:
+                url = f"http://127.0.0.1:{server.server_port}/{name}"
+                timings, counts = run_pipeline(url, models, work_dir)
+            finally:
+                shutil.rmtree(work_dir)
+
+            result = {
+                "time": time.time(),
+                "spec": name,
+                "provider": models.provider,
+                "recording": recording,
+                "timings": timings,
+                **counts,
+            }
+            print(
+                f"{name:<22} "
+                + " ".join(f"{timings[stage]:>7.2f}s" for stage in STAGES)
+                + f" {counts['documents']:>7} {counts['answered']:>3}/{len(constants.FAQ)}"
+            )
+            for stage, ratio in regressions(history, result).items():
+                failed.append(name)
+                print(f"  regression: {stage} is {ratio:.2f}x the median of the last runs")
+
+            os.makedirs(os.path.dirname(history_path) or ".", exist_ok=True)
+            with open(history_path, "a") as f:
+                f.write(json.dumps(result) + "\n")
+    finally:
+        server.shutdown()
+        shutil.rmtree(fixtures_dir)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,47 @@
+import gc
+import sys
+import tracemalloc
+
+from minifier import OpenAPIMinifierService
+from benchmarks.synthetic_spec import make_spec
+
+
+def traced(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def main(n_paths=5000):
+    spec = make_spec(n_paths=n_paths, n_schemas=200)
+    endpoints_by_method = OpenAPIMinifierService().run([spec])
+    documents = [doc for docs in endpoints_by_method.values() for doc in docs]
+
+    # The dicts are what run() used to return: every field materialized,
+    # including the content, title and filename strings.
+    def as_dicts():
+        return [doc.as_dict() for doc in documents]
+
+    def as_records():
+        return [
+            type(doc)(doc.tag, doc.operation_id, doc.server_url, doc.body, doc.tag_info, doc.doc_number)
+            for doc in documents
+        ]
+
+    dicts, dict_size = traced(as_dicts)
+    records, record_size = traced(as_records)
+    # Records reuse the minified body strings, count them since the dicts
+    # carry their own copy inside content.
+    record_size += sum(sys.getsizeof(doc.body) for doc in documents)
+
+    print(f"{len(documents)} endpoint documents")
+    print(f"dicts:   {dict_size / 2**20:8.1f} MiB  {dict_size / len(documents):8.0f} B/endpoint")
+    print(f"records: {record_size / 2**20:8.1f} MiB  {record_size / len(documents):8.0f} B/endpoint")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import asyncio
+from typing import Any, Dict
+
+from llama_index import ServiceContext, VectorStoreIndex
+from llama_index.llms.base import llm_completion_callback
+from llama_index.llms.types import CompletionResponse
+
+import constants
+from embedding import EmbeddingPipeline, FakeEmbedding
+from main import create_storage_context, embed_documents, indexed_documents, run_faq_queries
+from minifier import OpenAPIMinifierService
+from providers import FakeLLM
+from spec_parser import load_spec
+
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "petstore.yaml")
+
+# The FAQ questions take these many seconds each, the second one fails.
+LATENCIES = (0.4, 0.8, 1.2, 1.6)
+FAILING = 1
+
+# Concurrent queries should take about as long as the slowest one.
+TOLERANCE = 1.25
+
+
+class ScriptedLLM(FakeLLM):
+    # A FakeLLM whose latency depends on the question in the prompt, and
+    # that fails on one of them.
+    latencies: Dict[str, float] = {}
+    failing: str = ""
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        latency = next((value for question, value in self.latencies.items() if question in prompt), 0.0)
+        await asyncio.sleep(latency)
+        if self.failing and self.failing in prompt:
+            raise RuntimeError("injected LLM failure")
+        return CompletionResponse(text="".join(self._tokens(prompt)))
+
+
+def query_engine(llm):
+    with open(FIXTURE) as f:
+        spec = load_spec(f.read())
+    embed_model = FakeEmbedding()
+    service_context = ServiceContext.from_defaults(llm=llm, embed_model=embed_model)
+    nodes = embed_documents(
+        indexed_documents(OpenAPIMinifierService().run([spec])),
+        service_context,
+        EmbeddingPipeline(embed_model),
+        None,
+    )
+    index = VectorStoreIndex(
+        nodes, storage_context=create_storage_context(), service_context=service_context
+    )
+    context = constants.create_business_context("developers", "integration", "")
+    return index.as_query_engine(
+        text_qa_template=constants.create_qa_template(
+            constants.primer_prompt, context, constants.openapi_format_instructions
+        ),
+    )
+
+
+def timed_queries(engine, concurrency):
+    start = time.perf_counter()
+    answers = asyncio.run(
+        run_faq_queries(engine, constants.FAQ, concurrency=concurrency, retries=0)
+    )
+    return time.perf_counter() - start, answers
+
+
+def main():
+    llm = ScriptedLLM(
+        latencies=dict(zip(constants.FAQ, LATENCIES)), failing=constants.FAQ[FAILING]
+    )
+    engine = query_engine(llm)
+
+    slowest = max(LATENCIES)
+    total = sum(LATENCIES)
+    print(f"{len(constants.FAQ)} questions, slowest {slowest:.1f}s, {total:.1f}s one after another")
+
+    failed = []
+    for concurrency in (1, len(constants.FAQ)):
+        seconds, answers = timed_queries(engine, concurrency)
+        answered = [bool(answers[question]) for question in constants.FAQ]
+        print(f"concurrency {concurrency}: {seconds:.2f}s, answered {sum(answered)}/{len(answered)}")
+
+        if answered != [i != FAILING for i in range(len(constants.FAQ))]:
+            failed.append(f"concurrency {concurrency}: expected every answer but the failing one")
+        if concurrency > 1 and seconds > slowest * TOLERANCE:
+            failed.append(
+                f"concurrency {concurrency}: {seconds:.2f}s is over {TOLERANCE}x the slowest query"
+            )
+
+    for message in failed:
+        print(f"  failed: {message}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import sys
+import time
+
+import numpy as np
+from llama_index.schema import TextNode
+from llama_index.vector_stores import SimpleVectorStore
+from llama_index.vector_stores.types import VectorStoreQuery
+
+from retrieval import metadata_filters
+from vector_store import MetadataIndexedVectorStore
+
+
+METHODS = ("get", "post", "patch", "delete")
+
+
+def make_nodes(n_nodes, dim, n_tags=20, seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((n_nodes, dim), dtype=np.float32)
+    return [
+        TextNode(
+            id_=f"node{i}",
+            text="",
+            embedding=embeddings[i].tolist(),
+            metadata={"method": METHODS[i % len(METHODS)], "tag": f"Tag{i % n_tags}"},
+        )
+        for i in range(n_nodes)
+    ]
+
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(dim=1536, *sizes):
+    query_embedding = np.random.default_rng(1).standard_normal(dim).tolist()
+    queries = {
+        "unfiltered": None,
+        "method=get": metadata_filters(method="get"),
+        "method+tag": metadata_filters(method="get", tag="Tag4"),
+    }
+
+    print(f"{'nodes':>7} {'query':<12} {'simple':>10} {'indexed':>10}")
+    for n_nodes in sizes or (500, 5000, 20000):
+        nodes = make_nodes(n_nodes, dim)
+        simple = SimpleVectorStore()
+        simple.add(nodes)
+        indexed = MetadataIndexedVectorStore()
+        indexed.add(nodes)
+        # The first query builds the matrix and postings, like loading would.
+        indexed.query(VectorStoreQuery(query_embedding=query_embedding))
+
+        for name, filters in queries.items():
+            query = VectorStoreQuery(
+                query_embedding=query_embedding, similarity_top_k=4, filters=filters
+            )
+            assert simple.query(query).ids == indexed.query(query).ids
+            simple_time = timed(lambda: simple.query(query), repeat=1)
+            indexed_time = timed(lambda: indexed.query(query))
+            print(
+                f"{n_nodes:>7} {name:<12} {simple_time * 1000:>8.1f}ms {indexed_time * 1000:>8.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import yaml
+
+import metrics
+import main as pipeline
+from embedding import FakeEmbedding
+from fetcher import SpecFetcher
+from providers import FakeLLM, Models
+from benchmarks.synthetic_spec import make_spec
+
+
+def first_answer(spec_path, models, fetcher, lazy):
+    start = time.perf_counter()
+    first = None
+
+    def on_event(event, data):
+        nonlocal first
+        if event == "answer" and first is None:
+            first = time.perf_counter() - start
+
+    pipeline.main(
+        None,
+        spec_path,
+        "developers",
+        "integration",
+        "",
+        models=models,
+        lazy=lazy,
+        fetcher=fetcher,
+        on_event=on_event,
+    )
+    return first, time.perf_counter() - start, metrics.registry.recent_runs()[-1]
+
+
+def main(*sizes):
+    # Embedding time follows the tokens sent, roughly like a hosted model.
+    models = Models(
+        "fake",
+        FakeLLM(latency=0.2, tokens_per_second=200),
+        FakeEmbedding(latency=0.05, tokens_per_second=200000, embed_batch_size=100),
+    )
+    fetcher = SpecFetcher()
+    fetcher.allow_local_files = True
+    cwd = os.getcwd()
+
+    print(
+        f"{'paths':>6} {'mode':<6} {'first answer':>13} {'total':>8} {'parse':>7}"
+        f" {'indexed docs':>13} {'embedded tokens':>16} {'materialized':>13}"
+    )
+    for n_paths in sizes or (500, 2000):
+        # A fresh directory each time, so every run builds its index.
+        for lazy in (False, True):
+            directory = tempfile.mkdtemp()
+            os.chdir(directory)
+            try:
+                spec_path = os.path.join(directory, "spec.yaml")
+                with open(spec_path, "w") as f:
+                    yaml.safe_dump(
+                        make_spec(n_paths=n_paths, n_schemas=n_paths // 5), f, sort_keys=False
+                    )
+                pipeline.catalog_cache.entries.clear()
+
+                first, total, run = first_answer(spec_path, models, fetcher, lazy)
+                print(
+                    f"{n_paths:>6} {'lazy' if lazy else 'eager':<6} {first:>12.2f}s {total:>7.2f}s"
+                    f" {run['stages']['parse']['wall_seconds']:>6.2f}s"
+                    f" {run['counts'].get('documents', 0):>13}"
+                    f" {run['counts'].get('embedded_tokens', 0):>16}"
+                    f" {run['counts'].get('materialized_documents', 0):>13}"
+                )
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,159 @@
+import gc
+import os
+import sys
+import time
+import logging
+import tracemalloc
+
+import yaml
+
+from minifier import OpenAPIMinifierService
+from spec_parser import parse_spec
+from benchmarks.synthetic_spec import make_spec
+
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "petstore.yaml")
+
+
+def shared_components(n_schemas=40):
+    # The common library every service copies into its spec: errors,
+    # paging, money and so on, identical everywhere.
+    return {
+        f"Common{i}": {
+            "type": "object",
+            "description": f"Shared type {i}, see the platform guidelines for how it is used.",
+            "properties": {
+                f"field{j}": {"type": "string", "description": f"Field {j} of shared type {i}."}
+                for j in range(12)
+            },
+        }
+        for i in range(n_schemas)
+    }
+
+
+def service_spec(index, common):
+    # Services generated from different seeds reuse schema names with
+    # different content, those collide.
+    spec = make_spec(n_paths=30, n_schemas=15, seed=index)
+    spec["info"]["title"] = f"Service {index}"
+    spec["servers"] = [{"url": f"https://service{index}.example.com"}]
+    spec["paths"] = {f"/service{index}{path}": item for path, item in spec["paths"].items()}
+    spec["components"]["schemas"].update(common)
+    return yaml.safe_dump(spec, sort_keys=False)
+
+
+def traced_merge(specs):
+    minifier = OpenAPIMinifierService()
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    merged = minifier.create_full_spec(specs())
+    seconds = time.perf_counter() - start
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return merged, minifier.merge_collisions, seconds, retained, peak
+
+
+def operation(operation_id, summary):
+    return {"operationId": operation_id, "summary": summary, "responses": {"200": {"description": "OK"}}}
+
+
+def small_spec(title, url, paths):
+    return {
+        "openapi": "3.0.0",
+        "info": {"title": title, "version": "1.0.0"},
+        "servers": [{"url": url}],
+        "paths": paths,
+    }
+
+
+def server_urls(specs):
+    minifier = OpenAPIMinifierService()
+    endpoints_by_method = minifier.run(specs)
+    documents = [document for documents in endpoints_by_method.values() for document in documents]
+    return {document.operation_id: document for document in documents}, minifier.merge_collisions
+
+
+def check_merge_output():
+    # What merging changes in the documents: each spec keeps its own
+    # servers, and a repeated operation is the last spec's. A single spec
+    # still only uses its last root server, whatever its operations say.
+    failed = []
+
+    with open(FIXTURE) as f:
+        petstore = parse_spec(f.read())
+    root = petstore["servers"][-1]["url"]
+    documents, _ = server_urls([petstore])
+    moved = sorted(d.operation_id for d in documents.values() if not d.server_url.startswith(root))
+    if moved:
+        failed.append(f"single spec: {moved} do not use the root server")
+
+    first = small_spec(
+        "First",
+        "https://first.example.com",
+        {"/pets": {"get": operation("listPets", "first"), "delete": operation("deletePets", "first")}},
+    )
+    second = small_spec(
+        "Second",
+        "https://second.example.com",
+        {
+            "/pets": {"get": operation("listPets", "second"), "post": operation("createPet", "second")},
+            "/owners": {"get": operation("listOwners", "second")},
+        },
+    )
+    documents, collisions = server_urls([first, second])
+    expected = {
+        "listPets": "https://second.example.com/pets",
+        "deletePets": "https://first.example.com/pets",
+        "createPet": "https://second.example.com/pets",
+        "listOwners": "https://second.example.com/owners",
+    }
+    urls = {operation_id: document.server_url for operation_id, document in documents.items()}
+    if urls != expected:
+        failed.append(f"merged servers: {urls}, expected {expected}")
+    if "second" not in documents["listPets"].content:
+        failed.append("repeated operation: the last spec's should be kept")
+    if [(c["kind"], c["path"], c["method"], c["kept"]) for c in collisions] != [("operation", "/pets", "get", "last")]:
+        failed.append(f"repeated operation: reported {collisions}")
+    if any("x-merged-servers" in document.content for document in documents.values()):
+        failed.append("merged servers leak into document content")
+
+    for message in failed:
+        print(f"  failed: {message}")
+    return not failed
+
+
+def main(*sizes):
+    logging.disable(logging.WARNING)
+    if not check_merge_output():
+        sys.exit(1)
+    print("merge output: each spec keeps its servers, repeated operations keep the last spec's")
+
+    common = shared_components()
+    sizes = sizes or (50, 100, 200)
+    texts = [service_spec(index, common) for index in range(max(sizes))]
+
+    print(
+        f"{'specs':>6} {'input':<9} {'seconds':>8} {'peak MiB':>9} {'kept MiB':>9}"
+        f" {'paths':>6} {'schemas':>8} {'renamed':>8}"
+    )
+    for n_specs in sizes:
+        # A list holds every parsed spec until the merge is done, the
+        # generator parses one spec at a time.
+        inputs = {
+            "list": lambda: [parse_spec(text) for text in texts[:n_specs]],
+            "generator": lambda: (parse_spec(text) for text in texts[:n_specs]),
+        }
+        for name, specs in inputs.items():
+            merged, collisions, seconds, retained, peak = traced_merge(specs)
+            renamed = sum(1 for collision in collisions if collision["kind"] == "component")
+            print(
+                f"{n_specs:>6} {name:<9} {seconds:>7.2f}s {peak / 2**20:>9.1f} {retained / 2**20:>9.1f}"
+                f" {len(merged['paths']):>6} {len(merged['components']['schemas']):>8} {renamed:>8}"
+            )
+            del merged
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
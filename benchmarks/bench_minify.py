@@ -0,0 +1,60 @@
+import gc
+import sys
+import time
+import resource
+import subprocess
+import tracemalloc
+
+from minifier import OpenAPIMinifierService
+from benchmarks.synthetic_spec import make_spec
+
+
+def measure(mode, n_paths):
+    spec = make_spec(n_paths=n_paths, n_schemas=n_paths // 5)
+    service = OpenAPIMinifierService()
+    service.fused_transform_enabled = mode == "fused"
+
+    gc.collect()
+    collections = gc.get_stats()[0]["collections"]
+    start = time.process_time()
+    service.run([spec])
+    cpu = time.process_time() - start
+    # Young-generation collections are triggered by container allocations, so
+    # their count is a cheap proxy for how many dicts and lists were built.
+    collections = gc.get_stats()[0]["collections"] - collections
+
+    service = OpenAPIMinifierService()
+    service.fused_transform_enabled = mode == "fused"
+    spec = make_spec(n_paths=n_paths, n_schemas=n_paths // 5)
+    tracemalloc.start()
+    service.run([spec])
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{mode} {cpu:.3f} {collections} {traced_peak} {max_rss}")
+
+
+def main(n_paths=2000):
+    print(f"spec: {n_paths} paths, {n_paths // 5} schemas")
+    print(f"{'mode':<8}{'cpu s':>10}{'gen0 gcs':>10}{'traced peak MiB':>18}{'max rss MiB':>14}")
+    for mode in ("legacy", "fused"):
+        # Each mode runs in a fresh interpreter so max RSS is not shared.
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_minify", "--measure", mode, str(n_paths)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        cpu, collections, traced_peak, max_rss = output[1:]
+        print(
+            f"{mode:<8}{float(cpu):>10.3f}{int(collections):>10}"
+            f"{int(traced_peak) / 2**20:>18.1f}{int(max_rss) / 1024:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], int(sys.argv[3]))
+    else:
+        main(*(int(arg) for arg in sys.argv[1:]))
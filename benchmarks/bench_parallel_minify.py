@@ -0,0 +1,29 @@
+import os
+import sys
+import time
+
+from minifier import OpenAPIMinifierService
+from benchmarks.synthetic_spec import make_spec
+
+
+def main(n_paths=3000, chunk_size=64):
+    spec = make_spec(n_paths=n_paths, n_schemas=n_paths // 5)
+    print(f"spec: {n_paths} paths, chunk size {chunk_size}, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8}{'wall s':>10}{'speedup':>10}")
+
+    baseline = None
+    for workers in (1, 2, 4, 8):
+        service = OpenAPIMinifierService()
+        service.workers = workers
+        service.chunk_size = chunk_size
+
+        start = time.perf_counter()
+        service.minify(spec)
+        elapsed = time.perf_counter() - start
+
+        baseline = baseline or elapsed
+        print(f"{workers:>8}{elapsed:>10.2f}{baseline / elapsed:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
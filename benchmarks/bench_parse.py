@@ -0,0 +1,42 @@
+import sys
+import time
+import hashlib
+import tempfile
+
+import yaml
+
+import spec_parser
+from spec_parser import ParsedSpecCache, load_spec, parse_spec
+from benchmarks.synthetic_spec import make_spec
+
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(n_paths=2000):
+    spec = make_spec(n_paths=n_paths, n_schemas=n_paths // 5)
+    content = yaml.safe_dump(spec, sort_keys=False).encode("utf-8")
+    sha256 = hashlib.sha256(content).hexdigest()
+    print(f"spec: {n_paths} paths, {len(content) / 1024 / 1024:.1f} MiB of YAML")
+    print(f"loader: {spec_parser.SafeLoader.__name__}")
+
+    cold = timed(lambda: yaml.load(content, Loader=yaml.SafeLoader), repeat=1)
+    print(f"cold parse (SafeLoader): {cold:8.3f}s")
+
+    warm = timed(lambda: parse_spec(content))
+    print(f"warm parse (parse_spec): {warm:8.3f}s")
+
+    cache = ParsedSpecCache(cache_dir=tempfile.mkdtemp())
+    load_spec(content, sha256, cache)
+    hit = timed(lambda: load_spec(content, sha256, cache))
+    print(f"parsed-spec cache hit:   {hit:8.3f}s")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,94 @@
+import os
+import sys
+import copy
+import tempfile
+
+import yaml
+from llama_index import ServiceContext, VectorStoreIndex
+from llama_index.llms import MockLLM
+from llama_index.token_counter.mock_embed_model import MockEmbedding
+
+from main import indexed_documents
+from minifier import OpenAPIMinifierService
+from benchmarks.synthetic_spec import make_spec
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def token_counter():
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return "cl100k_base", lambda text: len(encoding.encode(text))
+    except Exception:
+        # No tiktoken or no way to fetch its vocabulary, words are close
+        # enough to compare the two modes.
+        return "words", lambda text: len(text.split())
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def measure(spec, dedupe_schemas, count_tokens):
+    minifier = OpenAPIMinifierService()
+    minifier.dedupe_schemas = dedupe_schemas
+    endpoints_by_method = minifier.run([spec])
+
+    documents = indexed_documents(endpoints_by_method)
+    tokens = sum(count_tokens(doc.text) for doc in documents)
+
+    service_context = ServiceContext.from_defaults(
+        llm=MockLLM(), embed_model=MockEmbedding(embed_dim=1536)
+    )
+    index = VectorStoreIndex.from_documents(documents, service_context=service_context)
+    with tempfile.TemporaryDirectory() as persist_dir:
+        index.storage_context.persist(persist_dir)
+        index_size = directory_size(persist_dir)
+
+    return len(documents), tokens, len(index.docstore.docs), index_size
+
+
+def specs():
+    # Every checked in fixture: petstore.yaml is small and barely shares
+    # schemas, so dedupe costs more than it saves, while billing.yaml embeds
+    # the same few schemas in nearly every endpoint. Then a large synthetic
+    # spec, and any spec paths given on the command line after these.
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        if name.endswith((".yaml", ".yml", ".json")):
+            with open(os.path.join(FIXTURES_DIR, name)) as f:
+                yield name, yaml.safe_load(f)
+    yield "synthetic", make_spec(n_paths=1000, n_schemas=200)
+
+
+def main(paths=()):
+    tokenizer, count_tokens = token_counter()
+    print(f"tokens counted with {tokenizer}")
+    print(f"{'spec':<20} {'mode':<8} {'docs':>6} {'tokens':>10} {'nodes':>6} {'index':>12}")
+
+    named_specs = list(specs())
+    for path in paths:
+        with open(path) as f:
+            named_specs.append((os.path.basename(path), yaml.safe_load(f)))
+
+    for name, spec in named_specs:
+        for dedupe_schemas in (False, True):
+            # run() rewrites parts of the spec it is given, each mode gets a copy.
+            documents, tokens, nodes, index_size = measure(
+                copy.deepcopy(spec), dedupe_schemas, count_tokens
+            )
+            mode = "dedupe" if dedupe_schemas else "inline"
+            print(
+                f"{name:<20} {mode:<8} {documents:>6} {tokens:>10} {nodes:>6} "
+                f"{index_size / 2**10:>9.0f} KiB"
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,86 @@
+import re
+import sys
+import json
+import string
+import timeit
+
+from minifier import OpenAPIMinifierService
+from serializer import clean_text, dict_to_text, json_document_text
+from benchmarks.synthetic_spec import make_spec
+
+
+def legacy_write_dict_to_text(data):
+    def remove_html_tags_and_punctuation(input_str):
+        no_html_str = re.sub("<.*?>", "", input_str)
+        modified_punctuation = set(string.punctuation) - {"/", "#"}
+        return (
+            "".join(ch for ch in no_html_str if ch not in modified_punctuation)
+            .lower()
+            .strip()
+        )
+
+    formatted_text_parts = []
+
+    if isinstance(data, dict):
+        for key, value in data.items():
+            key = remove_html_tags_and_punctuation(key)
+
+            if isinstance(value, (dict, list)):
+                formatted_text_parts.append(key)
+                formatted_text_parts.append(legacy_write_dict_to_text(value))
+            else:
+                value = remove_html_tags_and_punctuation(str(value))
+                formatted_text_parts.append(f"{key} {value}")
+    elif isinstance(data, list):
+        for item in data:
+            formatted_text_parts.append(legacy_write_dict_to_text(item))
+    else:
+        data = remove_html_tags_and_punctuation(str(data))
+        formatted_text_parts.append(data)
+
+    return "\n".join(filter(lambda x: x.strip(), formatted_text_parts))
+
+
+def legacy_document_text(data):
+    json_output = json.dumps(data, indent=0)
+    lines = json_output.split("\n")
+    useful_lines = [line for line in lines if not re.match(r"^[{}\[\],]*$", line)]
+    return "\n".join(useful_lines)
+
+
+def compare(name, legacy, fast, inputs, number):
+    assert [legacy(data) for data in inputs] == [fast(data) for data in inputs]
+
+    legacy_time = timeit.timeit(lambda: [legacy(data) for data in inputs], number=number)
+    clean_text.cache_clear()
+    fast_time = timeit.timeit(lambda: [fast(data) for data in inputs], number=number)
+    print(
+        f"{name:<20}{legacy_time / number * 1000:>12.1f}{fast_time / number * 1000:>12.1f}"
+        f"{legacy_time / fast_time:>10.1f}x"
+    )
+
+
+def main(n_paths=500, number=5):
+    service = OpenAPIMinifierService()
+    spec = make_spec(n_paths=n_paths, n_schemas=n_paths // 5)
+    trees = [
+        service.transform_endpoint(
+            service.populate_keys(service.resolve_refs(spec, endpoint), path)
+        )
+        for path, methods in spec["paths"].items()
+        for endpoint in methods.values()
+    ]
+    documents = [
+        {k: v for k, v in endpoint.items() if k != "content_hash"}
+        for endpoints in service.run([spec]).values()
+        for endpoint in endpoints
+    ]
+
+    print(f"{len(trees)} endpoint trees, {len(documents)} documents")
+    print(f"{'':<20}{'legacy ms':>12}{'fast ms':>12}{'speedup':>11}")
+    compare("write_dict_to_text", legacy_write_dict_to_text, dict_to_text, trees, number)
+    compare("document text", legacy_document_text, json_document_text, documents, number)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
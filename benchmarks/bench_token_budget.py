@@ -0,0 +1,51 @@
+import os
+import sys
+import copy
+import time
+
+import yaml
+
+from minifier import OpenAPIMinifierService
+from benchmarks.synthetic_spec import make_spec
+
+
+def report(spec, token_budget, top=10):
+    minifier = OpenAPIMinifierService()
+    minifier.token_budget = token_budget
+
+    start = time.perf_counter()
+    endpoints_by_method = minifier.run([copy.deepcopy(spec)])
+    elapsed = time.perf_counter() - start
+
+    budget_report = minifier.token_budget_report(endpoints_by_method)
+    before = budget_report["tokens_before"]
+    after = budget_report["tokens_after"]
+
+    print(f"budget {token_budget}: {budget_report['documents']} documents in {elapsed:.2f}s")
+    print(f"  tokens {before} -> {after} ({after / max(before, 1):.0%}), {budget_report['over_budget']} over budget")
+    for stage, totals in budget_report["stages"].items():
+        print(f"  {stage:<20} {totals['endpoints']:>6} endpoints {totals['tokens_removed']:>9} tokens removed")
+
+    largest = sorted(budget_report["endpoints"], key=lambda e: e["stages"]["full"], reverse=True)
+    print(f"  largest {top} endpoints:")
+    for endpoint in largest[:top]:
+        stages = " -> ".join(f"{stage} {tokens}" for stage, tokens in endpoint["stages"].items())
+        print(f"    {endpoint['method']:<6} {endpoint['operation_id']:<30} {stages}")
+
+
+def main(path=None, *budgets):
+    if path and path != "synthetic":
+        with open(path) as f:
+            spec = yaml.safe_load(f)
+        name = os.path.basename(path)
+    else:
+        spec = make_spec(n_paths=1000, n_schemas=200)
+        name = "synthetic"
+
+    print(name)
+    for token_budget in [int(budget) for budget in budgets] or [1024, 512, 256, 128]:
+        report(spec, token_budget)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
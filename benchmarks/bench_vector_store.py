@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import statistics
+
+import numpy as np
+from llama_index.vector_stores import SimpleVectorStore
+from llama_index.vector_stores.simple import SimpleVectorStoreData
+from llama_index.vector_stores.types import VectorStoreQuery
+
+from retrieval import metadata_filters
+from vector_store import MmapVectorStore
+
+
+METHODS = ("get", "post", "patch", "delete")
+
+
+def make_store(n_vectors, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n_vectors, dim), dtype=np.float32)
+    ids = [f"node{i}" for i in range(n_vectors)]
+    metadata = [{"method": METHODS[i % len(METHODS)], "tag": f"Tag{i % 50}"} for i in range(n_vectors)]
+    return vectors, ids, metadata
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def query_latency(store, query, repeat=5):
+    return statistics.median(timed(lambda: store.query(query))[0] for _ in range(repeat))
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def measure(name, load, queries):
+    load_time, store = timed(load)
+    first_query, _ = timed(lambda: store.query(queries["unfiltered"]))
+    latencies = {label: query_latency(store, query) for label, query in queries.items()}
+    print(
+        f"  {name:<6} load {load_time * 1000:>9.1f}ms  first query {first_query * 1000:>9.1f}ms  "
+        + "  ".join(f"{label} {latency * 1000:>8.2f}ms" for label, latency in latencies.items())
+    )
+    return store
+
+
+def main(dim=1536, json_limit=100000, *sizes):
+    query_embedding = np.random.default_rng(1).standard_normal(dim).tolist()
+    queries = {
+        "unfiltered": VectorStoreQuery(query_embedding=query_embedding, similarity_top_k=4),
+        "method+tag": VectorStoreQuery(
+            query_embedding=query_embedding,
+            similarity_top_k=4,
+            filters=metadata_filters(method="get", tag="Tag4"),
+        ),
+    }
+
+    for n_vectors in sizes or (10000, 100000, 1000000):
+        directory = tempfile.mkdtemp()
+        vectors, ids, metadata = make_store(n_vectors, dim)
+
+        mmap_path = os.path.join(directory, "mmap", "default__vector_store.json")
+        MmapVectorStore.write(mmap_path, vectors, ids, ids, metadata)
+        print(f"{n_vectors} vectors of {dim} dims")
+        print(f"  mmap   {directory_size(os.path.dirname(mmap_path)) / 2**20:>9.1f}MiB on disk")
+        mmap_store = measure("mmap", lambda: MmapVectorStore(mmap_path), queries)
+
+        if n_vectors <= json_limit:
+            json_path = os.path.join(directory, "json", "default__vector_store.json")
+            SimpleVectorStore(
+                SimpleVectorStoreData(
+                    embedding_dict=dict(zip(ids, vectors.tolist())),
+                    text_id_to_ref_doc_id=dict(zip(ids, ids)),
+                    metadata_dict=dict(zip(ids, metadata)),
+                )
+            ).persist(json_path)
+            print(f"  json   {directory_size(os.path.dirname(json_path)) / 2**20:>9.1f}MiB on disk")
+            json_store = measure("json", lambda: SimpleVectorStore.from_persist_path(json_path), queries)
+            for query in queries.values():
+                assert json_store.query(query).ids == mmap_store.query(query).ids
+            del json_store
+        else:
+            print(f"  json   skipped above {json_limit} vectors")
+
+        del vectors, mmap_store
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
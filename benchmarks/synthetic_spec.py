@@ -0,0 +1,109 @@
+import random
+
+
+def make_spec(n_paths=1000, n_schemas=200, seed=0, cyclic=False):
+    rng = random.Random(seed)
+    names = [f"Schema{i}" for i in range(n_schemas)]
+
+    schemas = {}
+    for i, name in enumerate(names):
+        properties = {}
+        for j in range(rng.randint(1, 6)):
+            kind = rng.random()
+            if kind < 0.3 and i + 1 < n_schemas:
+                target = names[rng.randint(i + 1, n_schemas - 1)]
+                properties[f"field{j}"] = {"$ref": f"#/components/schemas/{target}"}
+            elif kind < 0.4:
+                properties[f"field{j}"] = {
+                    "type": "array",
+                    "items": {"type": "string", "enum": ["active", "disabled"]},
+                    "example": ["active"],
+                }
+            elif kind < 0.5:
+                properties[f"field{j}"] = {
+                    "type": "object",
+                    "description": "<b>Nested</b> settings, see the docs!",
+                    "properties": {"value": {"type": "integer", "description": ""}},
+                }
+            else:
+                properties[f"field{j}"] = {
+                    "type": rng.choice(["string", "number", "boolean"]),
+                    "description": f"Field {j} of the {name} object.",
+                    "example": "example",
+                }
+        if cyclic and rng.random() < 0.2:
+            properties["parent"] = {"$ref": f"#/components/schemas/{name}"}
+
+        schemas[name] = {
+            "type": "object",
+            "description": f"The {name} object.",
+            "properties": properties,
+            "required": ["field0"],
+        }
+
+    paths = {}
+    for p in range(n_paths):
+        path_item = {}
+        for method in ("get", "post", "patch", "delete", "put"):
+            if rng.random() > 0.6:
+                continue
+
+            endpoint = {
+                "operationId": f"{method}Resource{p}",
+                "tags": [f"Tag{p % 12}"],
+                "summary": f"{method.upper()} resource {p}",
+                "description": f"Operates on <i>resource</i> {p}, it's documented here.",
+                "parameters": [
+                    {
+                        "name": "id",
+                        "in": "path",
+                        "required": True,
+                        "description": "The resource id.",
+                        "schema": {"type": "string"},
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "OK",
+                        "content": {
+                            "application/json": {
+                                "schema": {"$ref": f"#/components/schemas/{rng.choice(names)}"}
+                            }
+                        },
+                    },
+                    "404": {
+                        "description": "Not found",
+                        "content": {
+                            "application/json": {
+                                "schema": {"$ref": f"#/components/schemas/{rng.choice(names)}"}
+                            }
+                        },
+                    },
+                    "default": {"description": "Unexpected error"},
+                },
+            }
+            if method in ("post", "patch"):
+                endpoint["requestBody"] = {
+                    "content": {
+                        "application/json": {
+                            "schema": {"$ref": f"#/components/schemas/{rng.choice(names)}"}
+                        }
+                    }
+                }
+            if rng.random() < 0.05:
+                endpoint["deprecated"] = True
+            path_item[method] = endpoint
+
+        paths[f"/v1/resources{p}/{{id}}"] = path_item
+
+    return {
+        "openapi": "3.0.0",
+        "info": {"title": "Synthetic API", "version": "1.0.0"},
+        "servers": [{"url": "https://api.example.com"}],
+        "tags": [
+            {"name": f"Tag{i}", "description": f"Operations on <b>group {i}</b>."}
+            for i in range(8)
+        ],
+        "paths": paths,
+        "components": {"schemas": schemas},
+    }
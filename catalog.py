@@ -0,0 +1,107 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import metrics
+from documents import TagInfo
+from serializer import json_document_text
+
+
+class OperationCatalog:
+    # The cheap tier of the lazy mode: operationId, method, path, tag and
+    # summary of every operation, enough to list the spec and to retrieve
+    # coarsely. The full minified document of an operation is only built the
+    # first time it is asked for and kept for later queries.
+    def __init__(self, open_api_spec, minifier, excluded_keys=()):
+        self.minifier = minifier
+        self.excluded_keys = excluded_keys
+
+        with metrics.stage("catalog"):
+            self.open_api_spec = minifier.create_full_spec([open_api_spec])
+            self.entries = minifier.catalog(self.open_api_spec)
+            self.by_url = {(entry.method, entry.server_url): entry for entry in self.entries}
+
+            # Tag summaries come from the same lookup as in the eager mode,
+            # so a materialized document has the same text either way.
+            self.tag_infos = {
+                summary["name"]: TagInfo(summary["name"], summary["summary"], summary["tag_number"])
+                for summary in reversed(minifier.get_tag_summaries(self.entries, self.open_api_spec))
+            }
+
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    def list(self, method=None, tag=None):
+        return [
+            entry
+            for entry in self.entries
+            if (method is None or entry.method == method) and (tag is None or entry.tag == tag)
+        ]
+
+    def entry_text(self, entry):
+        return json_document_text(
+            {
+                "tag": entry.tag,
+                "operation_id": entry.operation_id,
+                "method": entry.method,
+                "server_url": entry.server_url,
+                "summary": entry.summary,
+            }
+        )
+
+    def entry_doc_id(self, entry):
+        text = self.entry_text(entry)
+        return f"catalog:{entry.method}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def document(self, method, server_url):
+        # Returns the minified document and its text, or None when the
+        # operation is not in the catalog.
+        key = (method, server_url)
+        entry = self.by_url.get(key)
+        if entry is None:
+            return None
+
+        # The minifier keeps a ref resolver between calls, so documents are
+        # built one at a time.
+        with self.lock:
+            materialized = self.documents.get(key)
+            if materialized is None:
+                with metrics.stage("materialize"):
+                    path_item = self.open_api_spec["paths"][entry.path]
+                    document = self.minifier.minify_operation(
+                        self.open_api_spec,
+                        self.minifier.server_url(self.open_api_spec, path_item, path_item[method]),
+                        entry.path,
+                        path_item[method],
+                    )
+                    document.tag_info = self.tag_infos.get(document.tag)
+                    materialized = self.documents[key] = (
+                        document,
+                        json_document_text(document, self.excluded_keys),
+                    )
+                metrics.count("materialized_documents")
+        return materialized
+
+
+class CatalogCache:
+    # Catalogs by spec hash and minifier settings, so documents materialized
+    # for one request are there for the next.
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, build):
+        with self.lock:
+            catalog = self.entries.get(key)
+            if catalog is not None:
+                self.entries.move_to_end(key)
+                return catalog
+
+        catalog = build()
+        with self.lock:
+            catalog = self.entries.setdefault(key, catalog)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return catalog
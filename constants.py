@@ -1,3 +1,5 @@
+import hashlib
+
 from llama_index import Prompt
 
 openapi_format_instructions = """\
@@ -54,6 +56,11 @@ def create_qa_template(primer_prompt, context, openapi_format_instructions):
     return Prompt(template)
 
 
+def qa_template_version():
+    template = create_qa_template(primer_prompt, "", openapi_format_instructions)
+    return hashlib.sha256(template.template.encode("utf-8")).hexdigest()[:16]
+
+
 FAQ = [
     "What is the most important API endpoint?",
     "What is a potential chokepoint for our customers?",
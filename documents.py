@@ -0,0 +1,122 @@
+import re
+import sys
+import hashlib
+from urllib.parse import urlparse
+from collections.abc import Mapping
+
+
+class TagInfo:
+    __slots__ = ("name", "summary", "number")
+
+    def __init__(self, name, summary, number):
+        self.name = name
+        self.summary = summary
+        self.number = number
+
+
+class EndpointDocument(Mapping):
+    # Endpoint documents used to be plain dicts, the Mapping interface keeps
+    # item access, get(), items() and dict(document) working for old callers.
+    KEYS = (
+        "tag",
+        "operation_id",
+        "server_url",
+        "content",
+        "tag_summary",
+        "tag_number",
+        "doc_number",
+        "title",
+        "filename",
+        "content_hash",
+    )
+
+    __slots__ = (
+        "tag",
+        "operation_id",
+        "server_url",
+        "body",
+        "tag_info",
+        "doc_number",
+        "schema_refs",
+        "token_counts",
+        "_content_hash",
+    )
+
+    def __init__(
+        self,
+        tag,
+        operation_id,
+        server_url,
+        body,
+        tag_info=None,
+        doc_number=None,
+        schema_refs=(),
+        token_counts=None,
+    ):
+        self.tag = sys.intern(tag) if isinstance(tag, str) else tag
+        self.operation_id = operation_id
+        self.server_url = server_url
+        self.body = body
+        self.tag_info = tag_info
+        self.doc_number = doc_number
+        self.schema_refs = schema_refs
+        self.token_counts = token_counts
+        self._content_hash = None
+
+    @property
+    def content(self):
+        return f"operationId: {self.operation_id} path: {self.server_url} content: {self.body}"
+
+    @property
+    def tag_summary(self):
+        return self.tag_info.summary if self.tag_info else None
+
+    @property
+    def tag_number(self):
+        return self.tag_info.number if self.tag_info else None
+
+    @property
+    def title(self):
+        parsed = urlparse(self.server_url)
+        if parsed.scheme and parsed.netloc:
+            return re.sub(r"https?://[^/]+/", "", self.server_url)
+        return self.server_url
+
+    @property
+    def filename(self):
+        return f"{self.tag_number}_{self.tag}_{self.operation_id}_{self.doc_number}"
+
+    @property
+    def content_hash(self):
+        if self._content_hash is None:
+            digest = hashlib.sha256()
+            for value in (self.tag, self.tag_summary, self.title, self.content):
+                digest.update(str(value).encode("utf-8"))
+                digest.update(b"\0")
+            self._content_hash = digest.hexdigest()
+        return self._content_hash
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.as_dict()!r})"
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.KEYS}
+
+
+class SchemaDocument(EndpointDocument):
+    __slots__ = ()
+
+    @property
+    def content(self):
+        return f"schema: {self.operation_id} content: {self.body}"
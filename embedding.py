@@ -0,0 +1,260 @@
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import List
+
+import numpy as np
+from llama_index.bridge.pydantic import PrivateAttr
+from llama_index.embeddings.base import BaseEmbedding
+from llama_index.schema import MetadataMode
+
+from tokenizer import approximate_token_count, get_token_counter
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        # Takes the tokens up front and sleeps off any debt outside the lock,
+        # so callers are served in order and a request larger than the
+        # bucket still goes through once enough time has passed.
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+class EmbeddingCheckpoint:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        embeddings = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line of a run that was killed mid-write.
+                        break
+                    embeddings[entry["key"]] = entry["embedding"]
+        except FileNotFoundError:
+            pass
+        return embeddings
+
+    def append(self, entries):
+        lines = "".join(
+            json.dumps({"key": key, "embedding": embedding}) + "\n"
+            for key, embedding in entries
+        )
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class EmbeddingStats(
+    namedtuple("EmbeddingStats", ["documents", "tokens", "batches", "resumed", "seconds"])
+):
+    @property
+    def documents_per_second(self):
+        return self.documents / self.seconds if self.seconds else 0.0
+
+    @property
+    def tokens_per_second(self):
+        return self.tokens / self.seconds if self.seconds else 0.0
+
+
+class EmbeddingPipeline:
+    checkpoint_name = "embeddings.checkpoint.jsonl"
+
+    def __init__(
+        self,
+        embed_model,
+        batch_size=100,
+        concurrency=4,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        retries=3,
+        backoff=1.0,
+        on_progress=None,
+    ):
+        self.embed_model = embed_model
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.on_progress = on_progress
+
+        self.request_bucket = None
+        if requests_per_minute:
+            self.request_bucket = TokenBucket(requests_per_minute / 60, requests_per_minute / 60)
+        self.token_bucket = None
+        if tokens_per_minute:
+            self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute / 60)
+
+        self.count_tokens = get_token_counter()
+
+    def checkpoint(self, checkpoint_dir):
+        return EmbeddingCheckpoint(os.path.join(checkpoint_dir, self.checkpoint_name))
+
+    def embed(self, nodes, checkpoint_dir=None):
+        # Checkpoints are keyed by the embedded text, node ids are random and
+        # change every time the documents are parsed again.
+        start = time.perf_counter()
+        checkpoint = self.checkpoint(checkpoint_dir) if checkpoint_dir else None
+        embeddings = checkpoint.load() if checkpoint else {}
+        resumed = len(embeddings)
+
+        texts = {}
+        for node in nodes:
+            if node.embedding is None:
+                text = node.get_content(metadata_mode=MetadataMode.EMBED)
+                key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+                if key not in embeddings:
+                    texts[key] = text
+
+        keys = list(texts)
+        batches = [keys[i : i + self.batch_size] for i in range(0, len(keys), self.batch_size)]
+        tokens = 0
+        done = 0
+        lock = threading.Lock()
+
+        def embed_batch(batch):
+            nonlocal tokens, done
+            batch_texts = [texts[key] for key in batch]
+            batch_tokens = sum(self.count_tokens(text) for text in batch_texts)
+
+            batch_embeddings = self.embed_with_retry(batch_texts, batch_tokens)
+            if checkpoint:
+                checkpoint.append(zip(batch, batch_embeddings))
+
+            with lock:
+                embeddings.update(zip(batch, batch_embeddings))
+                tokens += batch_tokens
+                done += len(batch)
+                if self.on_progress is not None:
+                    self.on_progress(done, len(keys))
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(embed_batch, batch) for batch in batches]
+            finished, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in finished:
+                if future.exception() is not None:
+                    for pending in futures:
+                        pending.cancel()
+                    raise future.exception()
+
+        for node in nodes:
+            if node.embedding is None:
+                text = node.get_content(metadata_mode=MetadataMode.EMBED)
+                node.embedding = embeddings[hashlib.sha256(text.encode("utf-8")).hexdigest()]
+
+        stats = EmbeddingStats(len(keys), tokens, len(batches), resumed, time.perf_counter() - start)
+        logging.info(
+            f"Embedded {stats.documents} texts ({stats.resumed} resumed) in {stats.seconds:.1f}s,"
+            f" {stats.documents_per_second:.1f} docs/s, {stats.tokens_per_second:.0f} tokens/s"
+        )
+        return stats
+
+    def embed_with_retry(self, texts, tokens):
+        requests = math.ceil(len(texts) / getattr(self.embed_model, "embed_batch_size", len(texts)))
+        for attempt in range(self.retries + 1):
+            if self.request_bucket is not None:
+                self.request_bucket.acquire(requests)
+            if self.token_bucket is not None:
+                self.token_bucket.acquire(tokens)
+            try:
+                return self.embed_model.get_text_embedding_batch(texts)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logging.warning(f"Embedding batch of {len(texts)} failed ({e!r}), retrying")
+                time.sleep(self.backoff * 2**attempt)
+
+
+class TransientEmbeddingError(Exception):
+    pass
+
+
+class FakeEmbedding(BaseEmbedding):
+    # Deterministic local embeddings for tests and benchmarks, with optional
+    # latency per call, throughput in tokens per second and randomly injected
+    # failures.
+    embed_dim: int = 1536
+    latency: float = 0.0
+    tokens_per_second: float = 0.0
+    error_rate: float = 0.0
+    seed: int = 0
+
+    _random: random.Random = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._random = random.Random(self.seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeEmbedding"
+
+    def _call(self, texts):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.tokens_per_second:
+            time.sleep(sum(approximate_token_count(text) for text in texts) / self.tokens_per_second)
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+        if failed:
+            raise TransientEmbeddingError("injected embedding failure")
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.embed_dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        self._call([query])
+        return self._vector(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        # The latency is slept off a worker thread, not the event loop.
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        self._call([text])
+        return self._vector(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        self._call(texts)
+        return [self._vector(text) for text in texts]
@@ -0,0 +1,201 @@
+import os
+import json
+import hashlib
+import tempfile
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from atomic_file import atomic_write
+
+
+FetchedSpec = namedtuple("FetchedSpec", ["url", "content", "sha256", "status_code", "from_cache"])
+
+
+class SpecTooLargeError(Exception):
+    pass
+
+
+class SpecFetcher:
+    def __init__(
+        self,
+        cache_dir="./cache/specs",
+        max_bytes=50 * 1024 * 1024,
+        max_cache_bytes=512 * 1024 * 1024,
+        chunk_size=64 * 1024,
+        timeout=30,
+        pool_maxsize=10,
+        session=None,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_cache_bytes = max_cache_bytes
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+        # Only for trusted callers like the batch CLI, never for URLs that
+        # come in over the web app.
+        self.allow_local_files = False
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+    def fetch(self, url):
+        if (self.allow_local_files and "://" not in url) or url.startswith("file://"):
+            return self.fetch_local(url)
+
+        entry = self.read_entry(url)
+
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 304 and entry:
+                content = self.read_blob(entry["sha256"])
+                if content is not None:
+                    return FetchedSpec(url, content, entry["sha256"], 304, True)
+
+                # The blob was evicted, by us or a concurrent job, so fetch it
+                # again in full.
+                response.close()
+                self.remove_entry(url)
+                return self.fetch(url)
+
+            if response.status_code != 200:
+                return FetchedSpec(url, None, None, response.status_code, False)
+
+            content_length = response.headers.get("Content-Length")
+            if content_length and int(content_length) > self.max_bytes:
+                raise SpecTooLargeError(
+                    f"{url} is {content_length} bytes, the limit is {self.max_bytes}"
+                )
+
+            sha256 = self.store_blob(url, response)
+            content = self.read_blob(sha256)
+            self.write_entry(
+                url,
+                {
+                    "url": url,
+                    "sha256": sha256,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                },
+            )
+
+        self.evict()
+        return FetchedSpec(url, content, sha256, 200, False)
+
+    def fetch_local(self, url):
+        if not self.allow_local_files:
+            raise ValueError(f"Local files are not allowed: {url}")
+
+        path = url[len("file://") :] if url.startswith("file://") else url
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return FetchedSpec(url, None, None, 404, False)
+        if size > self.max_bytes:
+            raise SpecTooLargeError(f"{url} is {size} bytes, the limit is {self.max_bytes}")
+
+        with open(path, "rb") as f:
+            content = f.read()
+        return FetchedSpec(url, content, hashlib.sha256(content).hexdigest(), 200, False)
+
+    def store_blob(self, url, response):
+        digest = hashlib.sha256()
+        size = 0
+
+        blob_dir = os.path.join(self.cache_dir, "blobs")
+        os.makedirs(blob_dir, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=blob_dir)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise SpecTooLargeError(
+                            f"{url} exceeded the limit of {self.max_bytes} bytes"
+                        )
+                    digest.update(chunk)
+                    tmp.write(chunk)
+
+            sha256 = digest.hexdigest()
+            os.replace(tmp_path, self.blob_path(sha256))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return sha256
+
+    def blob_path(self, sha256):
+        return os.path.join(self.cache_dir, "blobs", sha256)
+
+    def entry_path(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, "urls", f"{key}.json")
+
+    def read_blob(self, sha256):
+        path = self.blob_path(sha256)
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return content
+
+    def evict(self):
+        # Least recently read blobs go first. Their URL entries are left,
+        # a 304 for one falls back to a full fetch.
+        blobs = []
+        for entry in os.scandir(os.path.join(self.cache_dir, "blobs")):
+            if entry.name.startswith("tmp"):
+                # Still being downloaded, see store_blob.
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Evicted by a concurrent job.
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in blobs)
+        for _, size, path in sorted(blobs):
+            if total <= self.max_cache_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def read_entry(self, url):
+        try:
+            with open(self.entry_path(url)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def write_entry(self, url, entry):
+        atomic_write(self.entry_path(url), json.dumps(entry))
+
+    def remove_entry(self, url):
+        try:
+            os.remove(self.entry_path(url))
+        except FileNotFoundError:
+            pass
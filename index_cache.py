@@ -0,0 +1,110 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class IndexCache:
+    # Loaded indexes shared by every request in the process. Entries are
+    # stamped with the mtime and size of the persisted files, so an index
+    # rewritten on disk is loaded again, and sized by those files since the
+    # loaded stores take memory (or page cache) roughly in proportion.
+    def __init__(self, max_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.shared_loads = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+        self.last_load_seconds = 0.0
+
+    def version(self, persist_dir):
+        stamp = []
+        with os.scandir(persist_dir) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                if entry.name.endswith((".json", ".npy")):
+                    stat = entry.stat()
+                    stamp.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        return tuple(stamp)
+
+    def get(self, persist_dir, load):
+        key = os.path.abspath(persist_dir)
+        version = self.version(persist_dir)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            # Concurrent misses for the same index wait on the first load.
+            future = self.loading.get((key, version))
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = self.loading[(key, version)] = Future()
+            else:
+                self.shared_loads += 1
+        if not owner:
+            return future.result()
+
+        start = time.perf_counter()
+        try:
+            index = load()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.loading.pop((key, version), None)
+        elapsed = time.perf_counter() - start
+
+        with self.lock:
+            self.load_seconds += elapsed
+            self.last_load_seconds = elapsed
+            self.remember(key, version, index)
+        future.set_result(index)
+        return index
+
+    def put(self, persist_dir, index):
+        key = os.path.abspath(persist_dir)
+        version = self.version(persist_dir)
+        with self.lock:
+            self.remember(key, version, index)
+
+    def invalidate(self, persist_dir):
+        with self.lock:
+            self.entries.pop(os.path.abspath(persist_dir), None)
+
+    def remember(self, key, version, index):
+        size = sum(file_size for _, _, file_size in version)
+        self.entries[key] = (version, index, size)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > 1 and self.resident_bytes() > self.max_bytes:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def resident_bytes(self):
+        return sum(size for _, _, size in self.entries.values())
+
+    def stats(self):
+        with self.lock:
+            loads = self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared_loads": self.shared_loads,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "resident_bytes": self.resident_bytes(),
+                "load_seconds_total": self.load_seconds,
+                "load_seconds_last": self.last_load_seconds,
+                "load_seconds_mean": self.load_seconds / loads if loads else 0.0,
+            }
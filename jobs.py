@@ -0,0 +1,110 @@
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    # A streamed answer emits an event per token, only the last max_events
+    # are kept. Event positions keep counting from the first one, a client
+    # resuming from a dropped one gets the oldest kept.
+    max_events = 4096
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.events = []
+        self.dropped_events = 0
+        self.condition = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def emit(self, event, data):
+        with self.condition:
+            self.events.append((event, data))
+            if len(self.events) > self.max_events:
+                dropped = len(self.events) - self.max_events
+                del self.events[:dropped]
+                self.dropped_events += dropped
+            self.condition.notify_all()
+
+    def wait_for_events(self, start, timeout=None):
+        # Returns the position of the first event returned along with them.
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.dropped_events + len(self.events) > start, timeout=timeout
+            )
+            start = max(start, self.dropped_events)
+            return start, self.events[start - self.dropped_events :]
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    def __init__(self, max_workers=4, max_jobs=256):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, fn, *args, **kwargs):
+        with self.lock:
+            # Identical submissions share the job that is already queued or
+            # running instead of repeating the whole analysis.
+            job = self.in_flight.get(key)
+            if job is not None:
+                return job
+
+            job = Job(key)
+            self.jobs[job.id] = job
+            self.in_flight[key] = job
+            self.prune()
+
+        self.executor.submit(self.run, job, fn, *args, **kwargs)
+        return job
+
+    def run(self, job, fn, *args, **kwargs):
+        job.status = "running"
+        try:
+            job.result = fn(*args, on_event=job.emit, **kwargs)
+            job.status = "done"
+            job.emit("done", {"result": job.result})
+        except Exception as e:
+            logging.exception(f"Job {job.id} failed")
+            job.error = str(e)
+            job.status = "failed"
+            job.emit("error", {"error": job.error})
+        finally:
+            job.finished_at = time.time()
+            with self.lock:
+                if self.in_flight.get(job.key) is job:
+                    del self.in_flight[job.key]
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def prune(self):
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= self.max_jobs:
+                break
+            if self.jobs[job_id].finished:
+                del self.jobs[job_id]
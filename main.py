@@ -1,16 +1,29 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import os
-import re
 import json
-import yaml
+import asyncio
+import shutil
+import hashlib
 import logging
-import requests
+import threading
+import time
 
 import constants
+import metrics
+from answer_cache import AnswerCache
+from atomic_file import atomic_write
+from catalog import CatalogCache, OperationCatalog
+from embedding import EmbeddingPipeline
+from fetcher import SpecFetcher
+from index_cache import IndexCache
 from minifier import OpenAPIMinifierService
+from providers import create_models
+from retrieval import MaterializePostprocessor, SchemaReferencePostprocessor, metadata_filters
+from serializer import json_document_text
+from spec_parser import ParsedSpecCache, load_spec
+from vector_store import MetadataIndexedVectorStore, MmapVectorStore
 
-from llama_index.llms import OpenAI
 from llama_index.readers.schema.base import Document
 from llama_index import (
     VectorStoreIndex,
@@ -18,32 +31,144 @@ from llama_index import (
     load_index_from_storage,
     ServiceContext,
 )
+from llama_index.ingestion import run_transformations
+from llama_index.vector_stores.simple import DEFAULT_VECTOR_STORE
 
 
-def load_from_spec_url(url, data_format):
-    response = requests.get(url)
+spec_fetcher = SpecFetcher()
+parsed_spec_cache = ParsedSpecCache()
+answer_cache = AnswerCache()
+index_cache = IndexCache()
+catalog_cache = CatalogCache()
 
-    if response.status_code == 200:
-        if data_format == "yaml":
-            return yaml.safe_load(response.content.decode("utf-8"))
-        elif data_format == "json":
-            return response.json()
+
+def fetch_spec(url, fetcher=None):
+    with metrics.stage("fetch"):
+        fetched = (fetcher or spec_fetcher).fetch(url)
+
+    if fetched.content is not None:
+        with metrics.stage("parse"):
+            spec = load_spec(fetched.content, fetched.sha256, parsed_spec_cache)
+        return spec, fetched.sha256
     else:
-        print(f"Failed to fetch data from {url}. Status code: {response.status_code}")
-        return None
+        print(f"Failed to fetch data from {url}. Status code: {fetched.status_code}")
+        return None, None
+
+
+def load_from_spec_url(url, data_format=None):
+    # The format is sniffed from the payload, data_format is only kept for
+    # callers that still pass it.
+    return fetch_spec(url)[0]
+
+
+# Positional bookkeeping changes whenever an endpoint is added or removed
+# elsewhere in the spec, so it is kept out of the embedded text.
+DOCUMENT_EXCLUDED_KEYS = {"tag_number", "doc_number", "filename", "content_hash"}
 
 
-def download_json_data(input_data: list[dict]):
+# Already part of the document text, only kept as metadata for filtering.
+FILTER_METADATA_KEYS = ["tag", "operation_id", "path"]
+
+
+def download_json_data(input_data: list[dict], method: str = None):
     loaded = []
 
     for data in input_data:
-        json_output = json.dumps(data, indent=0)
-        lines = json_output.split("\n")
-        useful_lines = [line for line in lines if not re.match(r"^[{}\[\],]*$", line)]
-        loaded.append(Document(text="\n".join(useful_lines)))
+        text = json_document_text(data, DOCUMENT_EXCLUDED_KEYS)
+        metadata = {
+            "tag": data["tag"],
+            "operation_id": data["operation_id"],
+            "path": data["server_url"],
+        }
+        if method is None:
+            doc_id = data["content_hash"]
+        else:
+            # The content hash does not cover the method, and two methods on
+            # the same path can minify to the same text.
+            doc_id = f"{method}:{data['content_hash']}"
+            metadata["method"] = method
+
+        document = Document(
+            text=text,
+            doc_id=doc_id,
+            metadata=metadata,
+            excluded_embed_metadata_keys=list(FILTER_METADATA_KEYS),
+            excluded_llm_metadata_keys=list(FILTER_METADATA_KEYS),
+        )
+
+        # Only used to pull referenced schema documents in at query time.
+        schema_refs = getattr(data, "schema_refs", ())
+        if schema_refs:
+            document.metadata["schema_refs"] = list(schema_refs)
+            document.excluded_embed_metadata_keys.append("schema_refs")
+            document.excluded_llm_metadata_keys.append("schema_refs")
+
+        loaded.append(document)
     return loaded
 
 
+def indexed_documents(ep_by_method):
+    documents = []
+    endpoints = []
+    for method, method_endpoints in ep_by_method.items():
+        if method != "schemas":
+            documents.extend(download_json_data(method_endpoints, method))
+            endpoints.extend(method_endpoints)
+
+    # Only the schemas reachable from the indexed endpoints are worth embedding.
+    schemas = {data["operation_id"]: data for data in ep_by_method.get("schemas", [])}
+
+    pending = [name for data in endpoints for name in getattr(data, "schema_refs", ())]
+    referenced = {}
+    while pending:
+        name = pending.pop()
+        if name in referenced or name not in schemas:
+            continue
+        referenced[name] = schemas[name]
+        pending.extend(schemas[name].schema_refs)
+
+    documents.extend(
+        download_json_data([referenced[name] for name in sorted(referenced)])
+    )
+    return list({doc.doc_id: doc for doc in documents}.values())
+
+
+def catalog_documents(catalog):
+    documents = []
+    for entry in catalog.entries:
+        documents.append(
+            Document(
+                text=catalog.entry_text(entry),
+                doc_id=catalog.entry_doc_id(entry),
+                metadata={
+                    "tag": entry.tag,
+                    "operation_id": entry.operation_id,
+                    "path": entry.server_url,
+                    "method": entry.method,
+                },
+                excluded_embed_metadata_keys=FILTER_METADATA_KEYS + ["method"],
+                excluded_llm_metadata_keys=FILTER_METADATA_KEYS + ["method"],
+            )
+        )
+    return documents
+
+
+def get_catalog(open_api_spec, spec_hash, token_budget=None):
+    def build():
+        minifier = OpenAPIMinifierService()
+        minifier.token_budget = token_budget
+        return OperationCatalog(open_api_spec, minifier, DOCUMENT_EXCLUDED_KEYS)
+
+    return catalog_cache.get((spec_hash, token_budget), build)
+
+
+def schema_doc_ids(ep_by_method):
+    return {
+        data["operation_id"]: data["content_hash"]
+        for data in ep_by_method.get("schemas", [])
+    }
+
+
 def extract_final_answer(model_response: str):
     parts = model_response.split("Final Answer:")
 
@@ -55,47 +180,435 @@ def extract_final_answer(model_response: str):
         return ""
 
 
-def sanitize_path(url):
-    valid_chars = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*").findall(url)
-    return "".join(valid_chars)
+storage_manifest_lock = threading.Lock()
 
 
-def load_documents_and_create_index(ep_by_method, persist_dir, service_context):
-    if not os.path.exists(persist_dir):
-        documents = download_json_data(ep_by_method["post"])
-        index = VectorStoreIndex.from_documents(
-            documents, service_context=service_context
-        )
-        index.storage_context.persist(persist_dir)
+def corpus_hash(documents):
+    digest = hashlib.sha256()
+    for doc_id in sorted(doc.doc_id for doc in documents):
+        digest.update(doc_id.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def read_storage_manifest(storage_dir):
+    try:
+        with open(os.path.join(storage_dir, "manifest.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def storage_manifest_key(spec_url, mode=None):
+    # Each way of building documents from a spec keeps its own last index,
+    # an update from another mode's index would re-embed most of it.
+    return f"{spec_url} [{mode}]" if mode else spec_url
+
+
+def write_storage_manifest(storage_dir, manifest):
+    atomic_write(os.path.join(storage_dir, "manifest.json"), json.dumps(manifest, indent=2))
+
+
+def create_storage_context(persist_dir=None):
+    if persist_dir is None:
+        return StorageContext.from_defaults(vector_store=MmapVectorStore())
+
+    # Indexes persisted before the memory-mapped store keep their JSON one.
+    if MmapVectorStore.persisted(
+        os.path.join(persist_dir, f"{DEFAULT_VECTOR_STORE}__vector_store.json")
+    ):
+        vector_store = MmapVectorStore.from_persist_dir(persist_dir, DEFAULT_VECTOR_STORE)
     else:
-        storage_context = StorageContext.from_defaults(persist_dir=persist_dir)
-        index = load_index_from_storage(storage_context)
+        vector_store = MetadataIndexedVectorStore.from_persist_dir(
+            persist_dir, namespace=DEFAULT_VECTOR_STORE
+        )
+    return StorageContext.from_defaults(persist_dir=persist_dir, vector_store=vector_store)
+
+
+def index_persisted(persist_dir):
+    # An unfinished build leaves only its embedding checkpoint behind.
+    return os.path.exists(os.path.join(persist_dir, "index_store.json"))
+
+
+def embed_documents(documents, service_context, embedding_pipeline, checkpoint_dir):
+    with metrics.stage("split"):
+        nodes = run_transformations(documents, service_context.transformations)
+    with metrics.stage("embed"):
+        stats = embedding_pipeline.embed(nodes, checkpoint_dir)
+    metrics.count("nodes", len(nodes))
+    metrics.count("embedded_documents", stats.documents)
+    metrics.count("embedded_tokens", stats.tokens)
+    return nodes
 
-    return index
 
+def update_index(index, documents, embedding_pipeline, checkpoint_dir=None):
+    documents_by_id = {doc.doc_id: doc for doc in documents}
+    existing_ids = set(index.ref_doc_info.keys())
 
-def main(data_format: str, spec_url: str, audience: str, use_cases: str, comments: str):
-    ep_by_method = OpenAPIMinifierService().run(
-        [load_from_spec_url(spec_url, data_format)]
+    for doc_id in existing_ids - documents_by_id.keys():
+        index.delete_ref_doc(doc_id, delete_from_docstore=True)
+
+    new_documents = [documents_by_id[doc_id] for doc_id in documents_by_id.keys() - existing_ids]
+    index.insert_nodes(
+        embed_documents(
+            new_documents, index.service_context, embedding_pipeline, checkpoint_dir
+        )
     )
-    persist_dir = f"./storage/{sanitize_path(spec_url)}"
+    for document in new_documents:
+        index.docstore.set_document_hash(document.doc_id, document.hash)
+
+    return index
+
+
+def load_documents_and_create_index(
+    ep_by_method,
+    spec_url,
+    service_context,
+    storage_dir="./storage",
+    embedding_pipeline=None,
+    documents=None,
+    mode=None,
+):
+    if documents is None:
+        documents = indexed_documents(ep_by_method)
+    metrics.count("documents", len(documents))
+    if embedding_pipeline is None:
+        embedding_pipeline = EmbeddingPipeline(service_context.embed_model)
+
+    # Indexes are stored by the hash of their documents, so the same spec
+    # served from two URLs shares one index, and the manifest remembers which
+    # index each URL last used in each mode so a changed spec only re-embeds
+    # its diff.
+    version = corpus_hash(documents)
+    manifest_key = storage_manifest_key(spec_url, mode)
+    persist_dir = os.path.join(storage_dir, version)
+
+    def load(path):
+        with metrics.stage("load_index"):
+            return load_index_from_storage(
+                create_storage_context(path), service_context=service_context
+            )
+
+    # Built indexes are shared through index_cache without taking the
+    # manifest lock, concurrent requests for one spec wait on a single load.
+    index = None
+    if index_persisted(persist_dir):
+        try:
+            index = index_cache.get(persist_dir, lambda: load(persist_dir))
+        except (FileNotFoundError, ValueError):
+            # Removed while we were loading it, rebuilt below.
+            index = None
+        if index is not None and read_storage_manifest(storage_dir).get(manifest_key) == version:
+            return index
+
+    with storage_manifest_lock:
+        manifest = read_storage_manifest(storage_dir)
+        previous_version = manifest.get(manifest_key)
+
+        if index is None and index_persisted(persist_dir):
+            index = index_cache.get(persist_dir, lambda: load(persist_dir))
+        elif index is None and previous_version and index_persisted(
+            os.path.join(storage_dir, previous_version)
+        ):
+            # Read from disk rather than the cache, the update must not
+            # change an index other requests may be using.
+            index = load(os.path.join(storage_dir, previous_version))
+            # Embeddings are checkpointed into the new directory as they
+            # come in, a failed build picks up where it stopped next time.
+            update_index(index, documents, embedding_pipeline, persist_dir)
+            with metrics.stage("persist"):
+                index.storage_context.persist(persist_dir)
+            index_cache.put(persist_dir, index)
+        elif index is None:
+            nodes = embed_documents(
+                documents, service_context, embedding_pipeline, persist_dir
+            )
+            with metrics.stage("build_index"):
+                index = VectorStoreIndex(
+                    nodes,
+                    storage_context=create_storage_context(),
+                    service_context=service_context,
+                )
+                for document in documents:
+                    index.docstore.set_document_hash(document.doc_id, document.hash)
+            with metrics.stage("persist"):
+                index.storage_context.persist(persist_dir)
+            index_cache.put(persist_dir, index)
+        embedding_pipeline.checkpoint(persist_dir).remove()
+
+        manifest[manifest_key] = version
+        write_storage_manifest(storage_dir, manifest)
+
+        if previous_version and previous_version != version:
+            if previous_version not in manifest.values():
+                index_cache.invalidate(os.path.join(storage_dir, previous_version))
+                shutil.rmtree(
+                    os.path.join(storage_dir, previous_version), ignore_errors=True
+                )
+
+    return index
+
+
+def stream_query(query_engine, question, on_token, cancelled):
+    # Async streaming is not supported by the response synthesizers, so
+    # streamed queries run on a worker thread and report tokens as they come,
+    # until the caller gives up on them.
+    response = query_engine.query(question)
+    metrics.count("retrieved_nodes", len(response.source_nodes))
+    tokens = []
+    for token in response.response_gen:
+        if cancelled.is_set():
+            break
+        tokens.append(token)
+        on_token(token)
+    return "".join(tokens)
+
+
+async def query_with_retry(
+    query_engine, question, semaphore, timeout, retries, backoff, on_token=None, on_retry=None
+):
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                if on_token is None:
+                    response = await asyncio.wait_for(
+                        query_engine.aquery(question), timeout
+                    )
+                    metrics.count("retrieved_nodes", len(response.source_nodes))
+                    return response.response
+
+                cancelled = threading.Event()
+                worker = asyncio.ensure_future(
+                    asyncio.to_thread(stream_query, query_engine, question, on_token, cancelled)
+                )
+                try:
+                    return await asyncio.wait_for(asyncio.shield(worker), timeout)
+                finally:
+                    # The thread cannot be interrupted, it keeps its slot
+                    # until it notices and returns, so the next attempt never
+                    # streams next to it.
+                    if not worker.done():
+                        cancelled.set()
+                        await asyncio.gather(worker, return_exceptions=True)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            logging.warning(f"Query {question!r} failed ({e!r}), retrying")
+            if on_retry is not None:
+                on_retry()
+            await asyncio.sleep(backoff * 2**attempt)
+
+
+async def run_faq_queries(
+    query_engine,
+    questions,
+    concurrency=4,
+    timeout=120,
+    retries=2,
+    backoff=1.0,
+    on_event=None,
+):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(i, que):
+        on_token = on_retry = None
+        if on_event is not None:
+            on_token = lambda token: on_event("token", {"index": i, "token": token})
+            # Clears the tokens a failed attempt already streamed.
+            on_retry = lambda: on_event("reset", {"index": i})
+
+        start = time.perf_counter()
+        try:
+            response = await query_with_retry(
+                query_engine, que, semaphore, timeout, retries, backoff, on_token, on_retry
+            )
+            final_answer = extract_final_answer(response)
+            metrics.count("queries")
+            metrics.registry.observe("analysis_query_seconds", time.perf_counter() - start)
+        except Exception as e:
+            logging.error(f"Query {que!r} failed: {e!r}")
+            final_answer = ""
+
+        if on_event is not None:
+            on_event("answer", {"index": i, "question": que, "answer": final_answer})
+        return final_answer
+
+    answers = await asyncio.gather(*(answer(i, que) for i, que in enumerate(questions)))
+    return dict(zip(questions, answers))
+
+
+@metrics.profiled("analysis")
+def main(
+    data_format: str,
+    spec_url: str,
+    audience: str,
+    use_cases: str,
+    comments: str,
+    concurrency: int = 4,
+    timeout: float = 120,
+    retries: int = 2,
+    dedupe_schemas: bool = False,
+    token_budget: int = None,
+    method: str = None,
+    tag: str = None,
+    on_event=None,
+    models=None,
+    lazy: bool = False,
+    fetcher=None,
+):
+    def stage(name, message):
+        if on_event is not None:
+            on_event("stage", {"stage": name, "message": message})
+
+    if lazy and dedupe_schemas:
+        raise ValueError("Deduplicated schemas are not supported in the lazy mode")
+
+    open_api_spec, spec_hash = fetch_spec(spec_url, fetcher)
+    if open_api_spec is None:
+        raise ValueError(f"Could not load an OpenAPI spec from {spec_url}")
+    stage("fetched", "fetched")
+
+    if models is None:
+        models = create_models()
+
+    context = constants.create_business_context(audience, use_cases, comments)
+    template_version = constants.qa_template_version()
+    # Answers built from differently minified documents are kept apart.
+    if dedupe_schemas:
+        template_version = f"{template_version}-schemas"
+    if token_budget is not None:
+        template_version = f"{template_version}-budget{token_budget}"
+    if method is not None or tag is not None:
+        template_version = f"{template_version}-{method}-{tag}"
+    if models.provider != "openai":
+        template_version = f"{template_version}-{models.provider}"
+    if lazy:
+        template_version = f"{template_version}-lazy"
+    answer_cache.track(spec_url, spec_hash)
+
+    final_response = {}
+    for i, que in enumerate(constants.FAQ):
+        cached = answer_cache.get(spec_hash, context, template_version, que)
+        if cached is not None:
+            metrics.count("cached_answers")
+            final_response[que] = cached
+            if on_event is not None:
+                on_event("answer", {"index": i, "question": que, "answer": cached})
+
+    if len(final_response) == len(constants.FAQ):
+        return final_response
+
+    # The lazy mode indexes a catalog of the operations and only minifies
+    # the ones retrieved for an answer.
+    catalog = None
+    documents = None
+    ep_by_method = None
+    if lazy:
+        catalog = get_catalog(open_api_spec, spec_hash, token_budget)
+        documents = catalog_documents(catalog)
+        message = f"cataloged {len(catalog.entries)} operations"
+    else:
+        minifier = OpenAPIMinifierService()
+        minifier.dedupe_schemas = dedupe_schemas
+        minifier.token_budget = token_budget
+        with metrics.stage("minify"):
+            ep_by_method = minifier.run([open_api_spec])
+        endpoint_count = sum(len(endpoints) for endpoints in ep_by_method.values())
+        message = f"minified {endpoint_count} endpoints"
+        if token_budget is not None:
+            report = minifier.token_budget_report(ep_by_method)
+            logging.info(f"Token budget report: {report['stages']}")
+            message = (
+                f"{message}, {report['tokens_before']} -> {report['tokens_after']} tokens,"
+                f" {report['over_budget']} over budget"
+            )
+    stage("minified", message)
+
     service_context = ServiceContext.from_defaults(
-        llm=OpenAI(temperature=0.3)
+        llm=models.llm, embed_model=models.embed_model
     )
 
-    index = load_documents_and_create_index(ep_by_method, persist_dir, service_context)
+    embedding_pipeline = EmbeddingPipeline(
+        service_context.embed_model,
+        on_progress=lambda done, total: stage("embedding", f"embedded {done}/{total} documents"),
+    )
+    # Indexes embedded by another provider are not comparable, keep them apart.
+    storage_dir = "./storage"
+    if models.provider != "openai":
+        storage_dir = f"./storage-{models.provider}"
+    # Options that change the indexed documents keep an index of their own.
+    index_modes = []
+    if dedupe_schemas:
+        index_modes.append("schemas")
+    if token_budget is not None:
+        index_modes.append(f"budget{token_budget}")
+    if lazy:
+        index_modes.append("lazy")
+    with metrics.stage("index"):
+        index = load_documents_and_create_index(
+            ep_by_method,
+            spec_url,
+            service_context,
+            storage_dir=storage_dir,
+            embedding_pipeline=embedding_pipeline,
+            documents=documents,
+            mode="-".join(index_modes),
+        )
+    stage("indexed", "index ready")
 
-    context = constants.create_business_context(audience, use_cases, comments)
     qa_template = constants.create_qa_template(
         constants.primer_prompt, context, constants.openapi_format_instructions
     )
-    query_engine = index.as_query_engine(text_qa_template=qa_template)
+    node_postprocessors = []
+    if lazy:
+        node_postprocessors.append(MaterializePostprocessor(catalog=catalog))
+    if dedupe_schemas:
+        node_postprocessors.append(
+            SchemaReferencePostprocessor(
+                docstore=index.docstore, schema_doc_ids=schema_doc_ids(ep_by_method)
+            )
+        )
+    # The index may come from the cache, built with another run's models.
+    # Its retriever would embed the questions with them, so the queries go
+    # through a view of it on this run's models, whose async clients belong
+    # to this run's event loop.
+    index = VectorStoreIndex(
+        index_struct=index.index_struct,
+        storage_context=index.storage_context,
+        service_context=service_context,
+    )
+    query_engine = index.as_query_engine(
+        service_context=service_context,
+        text_qa_template=qa_template,
+        streaming=on_event is not None,
+        node_postprocessors=node_postprocessors,
+        filters=metadata_filters(method=method, tag=tag),
+    )
 
-    final_response = {}
-    for que in constants.FAQ:
-        response = query_engine.query(que)
-        final_response[que] = extract_final_answer(response.response)
-    return final_response
+    pending = [que for que in constants.FAQ if que not in final_response]
+
+    def on_pending_event(event, data):
+        # Indexes refer to the pending questions, map them back onto the FAQ.
+        data = dict(data, index=constants.FAQ.index(pending[data["index"]]))
+        on_event(event, data)
+
+    with metrics.stage("query"):
+        answers = asyncio.run(
+            run_faq_queries(
+                query_engine,
+                pending,
+                concurrency=concurrency,
+                timeout=timeout,
+                retries=retries,
+                on_event=on_pending_event if on_event is not None else None,
+            )
+        )
+
+    for que, answer in answers.items():
+        if answer:
+            answer_cache.put(spec_hash, context, template_version, que, answer)
+
+    final_response.update(answers)
+    return {que: final_response[que] for que in constants.FAQ}
 
 if __name__ == "__main__":
     data_format = input("Type yaml or json: ")
@@ -0,0 +1,325 @@
+import os
+import json
+import math
+import time
+import uuid
+import functools
+import pstats
+import bisect
+import logging
+import cProfile
+import resource
+import threading
+import contextvars
+import tracemalloc
+from collections import defaultdict, deque
+from contextlib import nullcontext
+
+
+current_run = contextvars.ContextVar("current_run", default=None)
+current_stage = contextvars.ContextVar("current_stage", default="")
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        # Only the peak is available here, in KiB on Linux and bytes on macOS.
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if os.uname().sysname == "Darwin" else maxrss * 1024
+
+
+class RunProfile:
+    # Wall and CPU time per stage of one analysis, peak memory sampled while
+    # each stage runs, and counts of what went through the pipeline. Stages
+    # nest, "minify/resolve_refs", and repeated stages add up. CPU time is
+    # the calling thread's, work handed to other threads only shows up in
+    # the wall time of the stage that waited for it.
+    sample_interval = 0.05
+
+    def __init__(self, name, profile_dir=None):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.profile_dir = profile_dir
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.status = None
+        self.stages = {}
+        self.counts = defaultdict(int)
+        self.rss = self.peak_rss = rss_bytes()
+        self.open_stages = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.profiler = None
+        self.tracing = False
+
+    def __enter__(self):
+        self.sampler.start()
+        if self.profile_dir:
+            self.start_profiling()
+        self.token = current_run.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        current_run.reset(self.token)
+        self.stopped.set()
+        self.sampler.join()
+        self.seconds = time.perf_counter() - self.start
+        self.status = "failed" if exc_type else "done"
+        if self.profile_dir:
+            self.dump_profiles()
+        record = self.to_dict()
+        registry.record_run(record)
+        logging.info(f"Run profile {json.dumps(record)}")
+
+    def sample(self):
+        while not self.stopped.wait(self.sample_interval):
+            rss = self.rss = rss_bytes()
+            with self.lock:
+                self.peak_rss = max(self.peak_rss, rss)
+                for stage in self.open_stages:
+                    stage.peak = max(stage.peak, rss)
+
+    def stage(self, name):
+        return Stage(self, name)
+
+    def finish_stage(self, path, wall, cpu, peak):
+        with self.lock:
+            entry = self.stages.get(path)
+            if entry is None:
+                entry = self.stages[path] = {
+                    "calls": 0,
+                    "wall_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "peak_rss_bytes": 0,
+                }
+            entry["calls"] += 1
+            entry["wall_seconds"] += wall
+            entry["cpu_seconds"] += cpu
+            entry["peak_rss_bytes"] = max(entry["peak_rss_bytes"], peak)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counts[name] += value
+
+    def start_profiling(self):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        self.profiler = cProfile.Profile()
+        try:
+            self.profiler.enable()
+        except ValueError as e:
+            # Another profiler already runs in this thread.
+            logging.warning(f"Not profiling run {self.id} ({e})")
+            self.profiler = None
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+
+    def dump_profiles(self):
+        base = os.path.join(self.profile_dir, f"{self.name}-{self.id}")
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(f"{base}.prof")
+            with open(f"{base}.prof.txt", "w") as f:
+                pstats.Stats(self.profiler, stream=f).sort_stats("cumulative").print_stats(50)
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            with open(f"{base}.tracemalloc.txt", "w") as f:
+                current, peak = tracemalloc.get_traced_memory()
+                f.write(f"traced {current} bytes, peak {peak} bytes\n")
+                for statistic in snapshot.statistics("lineno")[:50]:
+                    f.write(f"{statistic}\n")
+            # Left running when it was started by someone else.
+            if self.tracing:
+                tracemalloc.stop()
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "id": self.id,
+                "name": self.name,
+                "status": self.status,
+                "started_at": self.started_at,
+                "seconds": self.seconds,
+                "peak_rss_bytes": self.peak_rss,
+                "stages": {path: dict(entry) for path, entry in self.stages.items()},
+                "counts": dict(self.counts),
+            }
+
+
+class Stage:
+    # Entered around every endpoint by the minifier, so it reads the last
+    # sampled RSS instead of asking the OS.
+    __slots__ = ("run", "name", "path", "token", "peak", "wall", "cpu")
+
+    def __init__(self, run, name):
+        self.run = run
+        self.name = name
+
+    def __enter__(self):
+        parent = current_stage.get()
+        self.path = f"{parent}/{self.name}" if parent else self.name
+        self.token = current_stage.set(self.path)
+        self.peak = self.run.rss
+        with self.run.lock:
+            self.run.open_stages.add(self)
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.wall
+        cpu = time.thread_time() - self.cpu
+        current_stage.reset(self.token)
+        with self.run.lock:
+            self.run.open_stages.discard(self)
+        self.run.finish_stage(self.path, wall, cpu, self.peak)
+
+
+def stage(name):
+    run = current_run.get()
+    return nullcontext() if run is None else run.stage(name)
+
+
+def count(name, value=1):
+    run = current_run.get()
+    if run is not None:
+        run.count(name, value)
+
+
+def profiled(name):
+    # Runs the function inside a RunProfile. Callers opt in to cProfile and
+    # tracemalloc dumps for that call with profile_dir=, or record it into a
+    # RunProfile of their own with run=.
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, profile_dir=None, run=None, **kwargs):
+            if run is None:
+                with RunProfile(name, profile_dir):
+                    return fn(*args, **kwargs)
+
+            token = current_run.set(run)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                current_run.reset(token)
+
+        return wrapper
+
+    return decorator
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+def label_text(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def sample_text(value):
+    # Exact, :g would round large counters and sums to six digits.
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+class MetricsRegistry:
+    # Process-wide counters and histograms rendered in the Prometheus text
+    # format. Every run adds its total and per stage wall time, the last
+    # runs are kept whole for /metrics/runs.
+    seconds_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = defaultdict(int)
+        self.runs = deque(maxlen=100)
+
+    def observe(self, name, value, buckets=None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets or self.seconds_buckets)
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def record_run(self, run):
+        with self.lock:
+            self.runs.append(run)
+        self.inc("analysis_runs_total", run=run["name"], status=run["status"])
+        self.observe("analysis_run_seconds", run["seconds"], run=run["name"])
+        for path, entry in run["stages"].items():
+            self.observe("analysis_stage_seconds", entry["wall_seconds"], stage=path)
+            self.inc("analysis_stage_cpu_seconds_total", entry["cpu_seconds"], stage=path)
+        for name, value in run["counts"].items():
+            self.inc(f"analysis_{name}_total", value)
+
+    def recent_runs(self):
+        with self.lock:
+            return list(self.runs)
+
+    def render(self, gauges=None):
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            snapshots = [
+                (key, histogram.buckets, list(histogram.counts), histogram.sum)
+                for key, histogram in histograms
+            ]
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{label_text(labels)} {sample_text(value)}")
+
+        for (name, labels), buckets, counts, total in snapshots:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{label_text(labels + (('le', f'{bound:g}'),))} {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f"{name}_bucket{label_text(labels + (('le', '+Inf'),))} {cumulative}")
+            lines.append(f"{name}_sum{label_text(labels)} {sample_text(total)}")
+            lines.append(f"{name}_count{label_text(labels)} {cumulative}")
+
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {sample_text(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
@@ -1,6 +1,481 @@
-import string, re
-from urllib.parse import urlparse
-from collections import defaultdict
+import re
+import logging
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from documents import EndpointDocument, SchemaDocument, TagInfo
+from serializer import dict_to_text
+from tokenizer import get_token_counter
+
+
+CatalogEntry = namedtuple(
+    "CatalogEntry", ["method", "path", "server_url", "operation_id", "tag", "summary"]
+)
+
+HTTP_METHODS = {"get", "put", "post", "delete", "options", "head", "patch", "trace"}
+
+
+_worker_service = None
+_worker_spec = None
+
+
+def _init_minify_worker(service, open_api_spec):
+    global _worker_service, _worker_spec
+    _worker_service = service
+    _worker_spec = open_api_spec
+    # A forked worker inherits the parent's run, whose lock the sampler
+    # thread may have held at fork time and whose stages would be lost
+    # with the process anyway.
+    metrics.current_run.set(None)
+    metrics.current_stage.set("")
+
+
+def _minify_paths(paths):
+    return _worker_service.minify_paths(_worker_spec, paths)
+
+
+class SchemaReference(str):
+    # Stands in for a component schema that is emitted as its own document.
+    # It reads as plain text once serialized but can still be told apart in
+    # the resolved tree.
+    def __new__(cls, ref):
+        name = ref.split("/")[-1]
+        reference = super().__new__(cls, f"see schema {name}")
+        reference.ref = ref
+        reference.name = name
+        return reference
+
+    def __reduce__(self):
+        return SchemaReference, (self.ref,)
+
+
+def schema_references(data):
+    names = set()
+    stack = [data]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, dict):
+            stack.extend(current.values())
+        elif isinstance(current, list):
+            stack.extend(current)
+        elif isinstance(current, SchemaReference):
+            names.add(current.name)
+    return names
+
+
+def prune_depth(data, max_depth, depth=0):
+    if isinstance(data, dict):
+        if depth >= max_depth:
+            return {k: v for k, v in data.items() if not isinstance(v, (dict, list))}
+        return {k: prune_depth(v, max_depth, depth + 1) for k, v in data.items()}
+    elif isinstance(data, list):
+        if depth >= max_depth:
+            return [item for item in data if not isinstance(item, (dict, list))]
+        return [prune_depth(item, max_depth, depth + 1) for item in data]
+    else:
+        return data
+
+
+def component_refs(data, prefix="#/components/"):
+    refs = set()
+    stack = [data]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, dict):
+            ref = current.get("$ref")
+            if isinstance(ref, str) and ref.startswith(prefix):
+                refs.add(ref)
+            stack.extend(current.values())
+        elif isinstance(current, list):
+            stack.extend(current)
+    return refs
+
+
+def rewrite_refs(data, renames):
+    # Copies only the containers on the way to a renamed ref, everything
+    # else stays shared with the input.
+    if isinstance(data, dict):
+        rewritten = None
+        for key, value in data.items():
+            if key == "$ref" and isinstance(value, str) and value in renames:
+                new_value = renames[value]
+            else:
+                new_value = rewrite_refs(value, renames)
+            if new_value is not value:
+                if rewritten is None:
+                    rewritten = dict(data)
+                rewritten[key] = new_value
+        return data if rewritten is None else rewritten
+    elif isinstance(data, list):
+        rewritten = None
+        for i, item in enumerate(data):
+            new_item = rewrite_refs(item, renames)
+            if new_item is not item:
+                if rewritten is None:
+                    rewritten = list(data)
+                rewritten[i] = new_item
+        return data if rewritten is None else rewritten
+    else:
+        return data
+
+
+class RefResolver:
+    # A ref re-entered while it is still open is cut with
+    # circular_ref_marker. Refs that are part of a cycle are also only
+    # expanded max_ref_depth deep, counting the open ones of them, and cut
+    # with depth_ref_marker below that: densely cyclic specs would
+    # otherwise expand every path through their ref graph. Past
+    # max_ref_expansions cyclic refs in one resolve call every further one
+    # is cut with depth_ref_marker too, which bounds the whole expansion and
+    # not only its depth. Acyclic refs are always expanded whole.
+    def __init__(
+        self,
+        open_api_spec,
+        circular_ref_marker="circular",
+        kept_ref_prefix=None,
+        max_ref_depth=3,
+        depth_ref_marker="truncated",
+        max_ref_expansions=50,
+    ):
+        self.open_api_spec = open_api_spec
+        self.circular_ref_marker = circular_ref_marker
+        self.kept_ref_prefix = kept_ref_prefix
+        self.max_ref_depth = max_ref_depth
+        self.depth_ref_marker = depth_ref_marker
+        self.max_ref_expansions = max_ref_expansions
+        # Expansions that cut nothing are stored by ref. Those that did
+        # depend only on the cyclic refs open when they were entered, and
+        # are stored by (ref, open cyclic refs) with the cyclic refs they
+        # expanded, so they are built once too. One that ran out of
+        # max_ref_expansions depends on where it started and is not stored.
+        self.resolved = {}
+        self.expansions = {}
+        self.cyclic = {}
+        self.targets = {}
+
+    def lookup(self, ref):
+        ref_object = self.open_api_spec
+        for p in ref.split("/")[1:]:
+            ref_object = ref_object.get(p, {}) if isinstance(ref_object, dict) else {}
+        return ref_object
+
+    def resolve(self, data):
+        if not isinstance(data, (dict, list)):
+            return data
+
+        root = {} if isinstance(data, dict) else []
+        # Each frame is [source items, output, ref being expanded, whether a
+        # cycle or the depth bound was cut somewhere below it, cache key in
+        # case it was, cyclic refs expanded before it, whether
+        # max_ref_expansions was reached below it].
+        stack = [[self._items(data), root, None, False, None, 0, False]]
+        active = set()
+        open_cycles = set()
+        expanded = 0
+
+        while stack:
+            frame = stack[-1]
+            items, output, ref, cut, context_key, expanded_before, exhausted = frame
+
+            item = next(items, None)
+            if item is None:
+                stack.pop()
+                if ref is not None:
+                    active.discard(ref)
+                    open_cycles.discard(ref)
+                    if not cut:
+                        self.resolved[ref] = output
+                    elif not exhausted:
+                        self.resolved[context_key] = output
+                        self.expansions[context_key] = expanded - expanded_before
+                if stack:
+                    stack[-1][3] = stack[-1][3] or cut
+                    stack[-1][6] = stack[-1][6] or exhausted
+                continue
+
+            key, value = item
+
+            if key == "$ref" and isinstance(output, dict):
+                key = value.split("/")[-1]
+                if self.kept_ref_prefix and value.startswith(self.kept_ref_prefix):
+                    output[key] = SchemaReference(value)
+                    continue
+                if value in self.resolved:
+                    output[key] = self.resolved[value]
+                    continue
+                if value in active:
+                    output[key] = self.circular_ref_marker
+                    frame[3] = True
+                    continue
+                cyclic = self.is_cyclic(value)
+                if cyclic and len(open_cycles) >= self.max_ref_depth:
+                    output[key] = self.depth_ref_marker
+                    frame[3] = True
+                    continue
+
+                value_ref = value
+                value_context_key = (value_ref, frozenset(open_cycles))
+                # A stored expansion is only what expanding it here would
+                # give if it fits in what is left of max_ref_expansions.
+                if (
+                    value_context_key in self.resolved
+                    and expanded + self.expansions[value_context_key] <= self.max_ref_expansions
+                ):
+                    output[key] = self.resolved[value_context_key]
+                    expanded += self.expansions[value_context_key]
+                    frame[3] = True
+                    continue
+                if cyclic and expanded >= self.max_ref_expansions:
+                    output[key] = self.depth_ref_marker
+                    frame[3] = frame[6] = True
+                    continue
+                value = self.lookup(value)
+                if not isinstance(value, (dict, list)):
+                    self.resolved[value_ref] = value
+                    output[key] = value
+                    continue
+                active.add(value_ref)
+                value_expanded_before = expanded
+                if cyclic:
+                    open_cycles.add(value_ref)
+                    expanded += 1
+            else:
+                value_ref = value_context_key = None
+                value_expanded_before = expanded
+                if not isinstance(value, (dict, list)):
+                    if key is None:
+                        output.append(value)
+                    else:
+                        output[key] = value
+                    continue
+
+            child = {} if isinstance(value, dict) else []
+            if key is None:
+                output.append(child)
+            else:
+                output[key] = child
+            stack.append(
+                [self._items(value), child, value_ref, False, value_context_key, value_expanded_before, False]
+            )
+
+        return root
+
+    def ref_targets(self, ref):
+        targets = self.targets.get(ref)
+        if targets is None:
+            targets = self.targets[ref] = [
+                target
+                # Every ref resolve follows, not only component ones.
+                for target in component_refs(self.lookup(ref), prefix="")
+                if not (self.kept_ref_prefix and target.startswith(self.kept_ref_prefix))
+            ]
+        return targets
+
+    def is_cyclic(self, ref):
+        # Tarjan's strongly connected components over the refs reachable
+        # from ref, every ref it finishes is settled for later calls.
+        if ref in self.cyclic:
+            return self.cyclic[ref]
+
+        index = {ref: 0}
+        low = {ref: 0}
+        scc_stack = [ref]
+        on_stack = {ref}
+        work = [(ref, iter(self.ref_targets(ref)))]
+        while work:
+            node, targets = work[-1]
+            target = next(targets, None)
+            if target is not None:
+                if target in self.cyclic:
+                    continue
+                if target not in index:
+                    index[target] = low[target] = len(index)
+                    scc_stack.append(target)
+                    on_stack.add(target)
+                    work.append((target, iter(self.ref_targets(target))))
+                elif target in on_stack:
+                    low[node] = min(low[node], index[target])
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = scc_stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                cyclic = len(component) > 1 or node in self.ref_targets(node)
+                for member in component:
+                    self.cyclic[member] = cyclic
+        return self.cyclic[ref]
+
+    @staticmethod
+    def _items(data):
+        if isinstance(data, dict):
+            return iter(data.items())
+        return ((None, item) for item in data)
+
+
+class SpecMerger:
+    # Folds specs into one as they come, so a caller can hand over a
+    # generator and drop each parsed spec once it is added. The merged spec
+    # only keeps the paths, components and tags it took from each spec, the
+    # first spec is never modified.
+    #
+    # A component that differs from one already merged under the same name
+    # is renamed to <spec title>_<name> along with the refs to it, a
+    # repeated path and method keeps the last operation as update() did.
+    # Both are listed in collisions. A spec whose servers differ from the
+    # first spec's keeps them under servers_key on its path items, or on
+    # its operations when the path item came from another spec. A spec's
+    # own path and operation servers are left alone and unused, as before.
+    servers_key = "x-merged-servers"
+
+    def __init__(self):
+        self.merged = None
+        self.collisions = []
+        self.spec_count = 0
+        self.tag_names = set()
+        self.paths_sorted = True
+
+    def add(self, open_api_spec):
+        index = self.spec_count
+        self.spec_count += 1
+
+        if self.merged is None:
+            self.merged = {
+                key: value
+                for key, value in open_api_spec.items()
+                if key not in ("paths", "components", "tags")
+            }
+            self.merged["paths"] = {}
+            if "components" in open_api_spec:
+                self.merged["components"] = {}
+            if "tags" in open_api_spec:
+                self.merged["tags"] = []
+
+        renames = self.merge_components(open_api_spec, index)
+        self.merge_tags(open_api_spec)
+
+        servers = open_api_spec.get("servers") or None
+        paths = open_api_spec.get("paths") or {}
+        if renames:
+            paths = rewrite_refs(paths, renames)
+        for path, path_item in paths.items():
+            self.merge_path(path, path_item, servers, index)
+
+    def namespace(self, open_api_spec, index):
+        title = (open_api_spec.get("info") or {}).get("title") or ""
+        return re.sub(r"\W+", "", title.title()) or f"Spec{index}"
+
+    def merge_components(self, open_api_spec, index):
+        incoming = open_api_spec.get("components") or {}
+        if not incoming:
+            return {}
+        merged = self.merged.setdefault("components", {})
+
+        # A component equal to the merged one still has to be renamed when
+        # it refers to a component that was, the refs it resolves to differ.
+        renamed = set()
+        changed = True
+        while changed:
+            changed = False
+            for component_type, components in incoming.items():
+                existing = merged.get(component_type) or {}
+                for name, component in components.items():
+                    ref = f"#/components/{component_type}/{name}"
+                    if ref in renamed or name not in existing:
+                        continue
+                    if component != existing[name] or not renamed.isdisjoint(component_refs(component)):
+                        renamed.add(ref)
+                        changed = True
+
+        namespace = self.namespace(open_api_spec, index)
+        renames = {}
+        for ref in sorted(renamed):
+            component_type, name = ref.split("/")[2:4]
+            existing = merged[component_type]
+            new_name = f"{namespace}_{name}"
+            suffix = 2
+            while new_name in existing or new_name in incoming.get(component_type, {}):
+                new_name = f"{namespace}{suffix}_{name}"
+                suffix += 1
+            renames[ref] = f"#/components/{component_type}/{new_name}"
+            self.collisions.append(
+                {
+                    "kind": "component",
+                    "spec": index,
+                    "title": (open_api_spec.get("info") or {}).get("title"),
+                    "type": component_type,
+                    "name": name,
+                    "renamed": new_name,
+                }
+            )
+
+        for component_type, components in incoming.items():
+            existing = merged.setdefault(component_type, {})
+            for name, component in components.items():
+                ref = f"#/components/{component_type}/{name}"
+                if ref in renames:
+                    name = renames[ref].rsplit("/", 1)[1]
+                elif name in existing:
+                    continue
+                existing[name] = rewrite_refs(component, renames) if renames else component
+        return renames
+
+    def merge_tags(self, open_api_spec):
+        for tag in open_api_spec.get("tags") or ():
+            name = tag.get("name")
+            if name in self.tag_names:
+                continue
+            self.tag_names.add(name)
+            self.merged.setdefault("tags", []).append(tag)
+
+    def merge_path(self, path, path_item, servers, index):
+        paths = self.merged["paths"]
+        root_servers = self.merged.get("servers")
+        existing = paths.get(path)
+        if existing is None:
+            if servers is not None and servers != root_servers:
+                path_item = {**path_item, self.servers_key: servers}
+            if self.paths_sorted and paths and path < next(reversed(paths)):
+                self.paths_sorted = False
+            paths[path] = path_item
+            return
+
+        # Copied before the first change, it may still be a caller's dict.
+        if servers == (existing.get(self.servers_key) or root_servers):
+            servers = None
+        merged_item = None
+        for key, value in path_item.items():
+            if key in existing and (key not in HTTP_METHODS or value == existing[key]):
+                continue
+            if key in existing:
+                self.collisions.append(
+                    {"kind": "operation", "spec": index, "path": path, "method": key, "kept": "last"}
+                )
+            if merged_item is None:
+                merged_item = dict(existing)
+            if servers is not None and key in HTTP_METHODS:
+                value = {**value, self.servers_key: servers}
+            merged_item[key] = value
+        if merged_item is not None:
+            paths[path] = merged_item
+
+    def result(self):
+        if self.merged is None:
+            raise ValueError("No specs to merge")
+        if not self.paths_sorted:
+            self.merged["paths"] = dict(sorted(self.merged["paths"].items()))
+            self.paths_sorted = True
+        return self.merged
+
 
 class OpenAPIMinifierService:
     def __init__(self):
@@ -38,134 +513,333 @@ class OpenAPIMinifierService:
         }
 
         self.key_abbreviations_enabled = True
+        self.fused_transform_enabled = True
+
+        self.workers = 1
+        self.chunk_size = 64
+
+        self.dedupe_schemas = False
+
+        # Tokens allowed per document content, None keeps every document as
+        # configured above. Over budget documents lose the stages below in
+        # order until they fit, deep_levels cutting the nesting depth to each
+        # of token_budget_depths in turn.
+        self.token_budget = None
+        self.token_budget_stages = ["enums", "examples", "nested_descriptions", "deep_levels"]
+        self.token_budget_depths = (6, 4, 3, 2)
+        self.token_encoding = "cl100k_base"
+
+        # Refs that are part of a cycle are cut with a marker this many
+        # deep, and past this many of them per endpoint, see RefResolver.
+        self.max_ref_depth = 3
+        self.max_ref_expansions = 50
+        self.ref_resolver = None
+
+        # What the last create_full_spec renamed or dropped, see SpecMerger.
+        self.merge_collisions = []
 
     def run(self, open_api_specs):
-        full_open_api_specs = self.create_full_spec(open_api_specs)
+        with metrics.stage("create_full_spec"):
+            full_open_api_specs = self.create_full_spec(open_api_specs)
 
         endpoints_by_method = self.minify(full_open_api_specs)
 
-        for method in endpoints_by_method.keys():
-            endpoints_by_method[method] = sorted(
-                endpoints_by_method[method], key=lambda x: (x["tag"], x["operation_id"])
-            )
+        with metrics.stage("create_endpoint_documents"):
+            for method in endpoints_by_method.keys():
+                endpoints_by_method[method] = sorted(
+                    endpoints_by_method[method], key=lambda x: (x.tag, x.operation_id)
+                )
 
-            endpoints_by_method[method] = self.create_endpoint_documents(
-                endpoints_by_method[method], full_open_api_specs
-            )
+                endpoints_by_method[method] = self.create_endpoint_documents(
+                    endpoints_by_method[method], full_open_api_specs
+                )
 
+        metrics.count("endpoints", sum(len(endpoints) for endpoints in endpoints_by_method.values()))
         return endpoints_by_method
 
     def create_full_spec(self, open_api_specs):
-        merged_open_api_spec = None
-
+        # Takes any iterable of specs, a generator lets each parsed spec be
+        # freed as soon as it is merged.
+        merger = SpecMerger()
         for open_api_spec in open_api_specs:
-            if merged_open_api_spec is None:
-                merged_open_api_spec = open_api_spec
+            merger.add(open_api_spec)
+
+        self.merge_collisions = merger.collisions
+        if merger.collisions:
+            renamed = sum(1 for collision in merger.collisions if collision["kind"] == "component")
+            logging.warning(
+                f"Merging {merger.spec_count} specs renamed {renamed} colliding components"
+                f" and kept the last of {len(merger.collisions) - renamed} repeated operations"
+            )
+        metrics.count("merged_specs", merger.spec_count)
+        return merger.result()
+
+    def minify(self, open_api_spec):
+        endpoints_by_method = defaultdict(list)
+
+        if self.workers > 1:
+            paths = list(open_api_spec["paths"])
+            chunks = [
+                paths[i : i + self.chunk_size]
+                for i in range(0, len(paths), self.chunk_size)
+            ]
+            # Workers get the spec once through the initializer (inherited
+            # as-is when processes are forked) and each task only carries a
+            # list of path names. map() keeps the chunks in submission order,
+            # so the result is the same as the sequential loop below. The
+            # sub-stages run in the workers and are not broken down.
+            with metrics.stage("minify_paths"), ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_minify_worker,
+                initargs=(self, open_api_spec),
+            ) as executor:
+                for chunk_endpoints in executor.map(_minify_paths, chunks):
+                    for method, endpoint_document in chunk_endpoints:
+                        endpoints_by_method[method].append(endpoint_document)
+        else:
+            with metrics.stage("minify_paths"):
+                for method, endpoint_document in self.minify_paths(
+                    open_api_spec, open_api_spec["paths"]
+                ):
+                    endpoints_by_method[method].append(endpoint_document)
+
+        if self.dedupe_schemas:
+            with metrics.stage("minify_schemas"):
+                schema_documents = self.minify_schemas(
+                    open_api_spec,
+                    {
+                        name
+                        for endpoints in endpoints_by_method.values()
+                        for endpoint in endpoints
+                        for name in endpoint.schema_refs
+                    },
+                )
+            if schema_documents:
+                endpoints_by_method["schemas"] = schema_documents
+
+        return endpoints_by_method
 
+    def minify_schemas(self, open_api_spec, names):
+        schemas = open_api_spec.get("components", {}).get("schemas", {})
+
+        schema_documents = []
+        pending = sorted(names)
+        seen = set(pending)
+
+        while pending:
+            name = pending.pop()
+            if name not in schemas:
+                continue
+
+            ref = f"#/components/schemas/{name}"
+            extracted_schema_data = self.resolve_refs(open_api_spec, schemas[name])
+            schema_refs = tuple(sorted(schema_references(extracted_schema_data)))
+            for referenced in schema_refs:
+                if referenced not in seen:
+                    seen.add(referenced)
+                    pending.append(referenced)
+
+            if isinstance(extracted_schema_data, dict):
+                processed_schema, token_counts = self.minify_to_budget(
+                    extracted_schema_data, f"schema: {name} content: "
+                )
             else:
-                merged_open_api_spec["paths"].update(open_api_spec["paths"])
+                processed_schema = self.write_dict_to_text(extracted_schema_data)
+                token_counts = None
+
+            schema_documents.append(
+                SchemaDocument(
+                    "schemas",
+                    name,
+                    ref,
+                    processed_schema,
+                    schema_refs=schema_refs,
+                    token_counts=token_counts,
+                )
+            )
 
-                if "components" in open_api_spec:
-                    if "components" not in merged_open_api_spec:
-                        merged_open_api_spec["components"] = {}
+        return schema_documents
 
-                    for component_type, components in open_api_spec["components"].items():
-                        if component_type not in merged_open_api_spec["components"]:
-                            merged_open_api_spec["components"][component_type] = {}
+    def minify_paths(self, open_api_spec, paths):
+        minified_endpoints = []
 
-                        merged_open_api_spec["components"][component_type].update(components)
+        for path in paths:
+            methods = open_api_spec["paths"][path]
+            for method, endpoint in methods.items():
+                if self.handles_operation(method, endpoint):
+                    minified_endpoints.append(
+                        (
+                            method,
+                            self.minify_operation(
+                                open_api_spec,
+                                self.server_url(open_api_spec, methods, endpoint),
+                                path,
+                                endpoint,
+                            ),
+                        )
+                    )
 
-        merged_open_api_spec["paths"] = dict(
-            sorted(merged_open_api_spec["paths"].items())
-        )
-        if "components" in merged_open_api_spec:
-            for component_type in merged_open_api_spec["components"]:
-                merged_open_api_spec["components"][component_type] = dict(sorted(merged_open_api_spec["components"][component_type].items()))
+        return minified_endpoints
 
+    def server_url(self, open_api_spec, path_item, endpoint):
+        # Servers a merge kept for a later spec override the first spec's,
+        # see SpecMerger.
+        key = SpecMerger.servers_key
+        servers = endpoint.get(key) or path_item.get(key) or open_api_spec["servers"]
+        return servers[-1]["url"]
+
+    def handles_operation(self, method, endpoint):
+        if method not in self.methods_to_handle:
+            return False
+        return not (endpoint.get("deprecated", False) and not self.keys_to_keep["deprecated"])
+
+    def minify_operation(self, open_api_spec, server_url, path, endpoint):
+        if self.keys_to_keep["schemas"]:
+            with metrics.stage("resolve_refs"):
+                extracted_endpoint_data = self.resolve_refs(open_api_spec, endpoint)
+        else:
+            extracted_endpoint_data = endpoint
 
-        return merged_open_api_spec
+        with metrics.stage("populate_keys"):
+            extracted_endpoint_data = self.populate_keys(extracted_endpoint_data, path)
 
-    def minify(self, open_api_spec):
-        server_url = open_api_spec["servers"][-1]["url"]
+        schema_refs = ()
+        if self.dedupe_schemas:
+            schema_refs = tuple(sorted(schema_references(extracted_endpoint_data)))
 
-        endpoints_by_method = defaultdict(list)
+        tags = endpoint.get("tags", [])
+        tag = tags[0] if tags else "default"
+
+        operation_id = endpoint.get("operationId", "")
+        with metrics.stage("transform"):
+            processed_endpoint, token_counts = self.minify_to_budget(
+                extracted_endpoint_data,
+                f"operationId: {operation_id} path: {server_url}{path} content: ",
+            )
+
+        return EndpointDocument(
+            tag,
+            operation_id,
+            f"{server_url}{path}",
+            processed_endpoint,
+            schema_refs=schema_refs,
+            token_counts=token_counts,
+        )
 
+    def catalog(self, open_api_spec):
+        # One entry per handled operation, read straight from paths without
+        # resolving refs or minifying anything.
+        entries = []
         for path, methods in open_api_spec["paths"].items():
             for method, endpoint in methods.items():
-                if method not in self.methods_to_handle:
+                if not self.handles_operation(method, endpoint):
                     continue
-                if (
-                    endpoint.get("deprecated", False)
-                    and not self.keys_to_keep["deprecated"]
-                ):
-                    continue
-
-                if self.keys_to_keep["schemas"]:
-                    extracted_endpoint_data = self.resolve_refs(open_api_spec, endpoint)
-                else:
-                    extracted_endpoint_data = endpoint
-
-                extracted_endpoint_data = self.populate_keys(
-                    extracted_endpoint_data, path
-                )
-
-                extracted_endpoint_data = self.remove_empty_keys(
-                    extracted_endpoint_data
+                tags = endpoint.get("tags", [])
+                entries.append(
+                    CatalogEntry(
+                        method,
+                        path,
+                        f"{self.server_url(open_api_spec, methods, endpoint)}{path}",
+                        endpoint.get("operationId", ""),
+                        tags[0] if tags else "default",
+                        endpoint.get("summary") or "",
+                    )
                 )
+        return entries
 
-                extracted_endpoint_data = self.remove_unnecessary_keys(
-                    extracted_endpoint_data
-                )
+    def minify_to_budget(self, endpoint, content_prefix):
+        if self.token_budget is None:
+            return self.write_dict_to_text(self.transform_endpoint(endpoint)), None
 
-                extracted_endpoint_data = self.flatten_endpoint(extracted_endpoint_data)
+        count_tokens = get_token_counter(self.token_encoding)
+        keys_to_keep = dict(self.keys_to_keep)
+        max_depth = None
 
-                if self.key_abbreviations_enabled:
-                    extracted_endpoint_data = self.abbreviate(
-                        extracted_endpoint_data, self.key_abbreviations
-                    )
+        text = self.write_dict_to_text(self.transform_endpoint(endpoint, keys_to_keep))
+        token_counts = [("full", count_tokens(content_prefix + text))]
 
-                tags = endpoint.get("tags", [])
-                tag = tags[0] if tags else "default"
+        for stage, key, depth in self.token_budget_steps():
+            if token_counts[-1][1] <= self.token_budget:
+                break
 
-                operation_id = endpoint.get("operationId", "")
-                processed_endpoint = self.write_dict_to_text(extracted_endpoint_data)
-                content_string = f"operationId: {operation_id} path: {server_url}{path} content: {processed_endpoint}"
+            if key is not None:
+                if not keys_to_keep.get(key):
+                    continue
+                keys_to_keep[key] = False
+            else:
+                max_depth = depth
 
+            transformed = self.transform_endpoint(endpoint, keys_to_keep)
+            if max_depth is not None:
+                transformed = prune_depth(transformed, max_depth)
+            text = self.write_dict_to_text(transformed)
+            token_counts.append((stage, count_tokens(content_prefix + text)))
 
-                endpoint_dict = {
-                    "tag": tag,
-                    "operation_id": operation_id,
-                    "server_url": f"{server_url}{path}",
-                    "content": content_string,
-                }
+        return text, tuple(token_counts)
 
-                endpoints_by_method[method].append(endpoint_dict)
+    def token_budget_steps(self):
+        for stage in self.token_budget_stages:
+            if stage == "deep_levels":
+                for depth in self.token_budget_depths:
+                    yield f"depth_{depth}", None, depth
+            else:
+                yield stage, stage, None
 
-        return endpoints_by_method
+    def token_budget_report(self, endpoints_by_method):
+        endpoints = []
+        stages = {}
 
-    def resolve_refs(self, open_api_spec, endpoint):
-        if isinstance(endpoint, dict):
-            new_endpoint = {}
-            for key, value in endpoint.items():
-                if key == "$ref":
-                    ref_path = value.split("/")[1:]
-                    ref_object = open_api_spec
-                    for p in ref_path:
-                        ref_object = ref_object.get(p, {})
+        for method, documents in endpoints_by_method.items():
+            for document in documents:
+                if document.token_counts is None:
+                    continue
 
-                    ref_object = self.resolve_refs(open_api_spec, ref_object)
+                previous = None
+                for stage, tokens in document.token_counts:
+                    if previous is not None:
+                        totals = stages.setdefault(stage, {"endpoints": 0, "tokens_removed": 0})
+                        totals["endpoints"] += 1
+                        totals["tokens_removed"] += previous - tokens
+                    previous = tokens
+
+                endpoints.append(
+                    {
+                        "method": method,
+                        "operation_id": document.operation_id,
+                        "path": document.server_url,
+                        "stages": dict(document.token_counts),
+                        "tokens": previous,
+                        "within_budget": previous <= self.token_budget,
+                    }
+                )
 
-                    new_key = ref_path[-1]
-                    new_endpoint[new_key] = ref_object
-                else:
-                    new_endpoint[key] = self.resolve_refs(open_api_spec, value)
-            return new_endpoint
+        return {
+            "token_budget": self.token_budget,
+            "documents": len(endpoints),
+            "tokens_before": sum(e["stages"]["full"] for e in endpoints),
+            "tokens_after": sum(e["tokens"] for e in endpoints),
+            "over_budget": sum(not e["within_budget"] for e in endpoints),
+            "stages": stages,
+            "endpoints": endpoints,
+        }
 
-        elif isinstance(endpoint, list):
-            return [self.resolve_refs(open_api_spec, item) for item in endpoint]
+    def resolve_refs(self, open_api_spec, endpoint):
+        kept_ref_prefix = "#/components/schemas/" if self.dedupe_schemas else None
+        if (
+            self.ref_resolver is None
+            or self.ref_resolver.open_api_spec is not open_api_spec
+            or self.ref_resolver.kept_ref_prefix != kept_ref_prefix
+            or self.ref_resolver.max_ref_depth != self.max_ref_depth
+            or self.ref_resolver.max_ref_expansions != self.max_ref_expansions
+        ):
+            self.ref_resolver = RefResolver(
+                open_api_spec,
+                kept_ref_prefix=kept_ref_prefix,
+                max_ref_depth=self.max_ref_depth,
+                max_ref_expansions=self.max_ref_expansions,
+            )
 
-        else:
-            return endpoint
+        return self.ref_resolver.resolve(endpoint)
 
     def populate_keys(self, endpoint, path):
         extracted_endpoint_data = {}
@@ -205,6 +879,130 @@ class OpenAPIMinifierService:
 
         return extracted_endpoint_data
 
+    def transform_endpoint(self, endpoint, keys_to_keep=None):
+        keys_to_keep = keys_to_keep or self.keys_to_keep
+        abbreviations = (
+            self.key_abbreviations if self.key_abbreviations_enabled else None
+        )
+
+        # abbreviate() looks values up by str(value), which the fused walk
+        # only does for scalars. Abbreviation tables that could match the
+        # repr of a container, or that map to non-strings, take the slow path.
+        if not self.fused_transform_enabled or (
+            abbreviations is not None
+            and any(
+                not isinstance(key, str)
+                or key.startswith(("{", "["))
+                or not isinstance(value, str)
+                for key, value in abbreviations.items()
+            )
+        ):
+            endpoint = self.remove_empty_keys(endpoint)
+            endpoint = self.remove_unnecessary_keys(endpoint, keys_to_keep)
+            endpoint = self.flatten_endpoint(endpoint)
+            if abbreviations is not None:
+                endpoint = self.abbreviate(endpoint, abbreviations)
+            return endpoint
+
+        return self.fused_transform(endpoint, abbreviations, keys_to_keep)
+
+    def fused_transform(self, endpoint, abbreviations, keys_to_keep=None):
+        # Applies remove_empty_keys, remove_unnecessary_keys, flatten_endpoint
+        # and abbreviate in a single walk that only reads the input and builds
+        # the output once.
+        keys_to_keep = keys_to_keep or self.keys_to_keep
+        drop_examples = not keys_to_keep["examples"]
+        drop_enums = not keys_to_keep["enums"]
+        drop_nested_descriptions = not keys_to_keep["nested_descriptions"]
+        flatten_keep_keys = {"responses", "default", "200"}
+
+        def kept_items(data, nested):
+            return [
+                (key, value)
+                for key, value in data.items()
+                if value is not None
+                and value != ""
+                and not (key == "example" and drop_examples)
+                and not (key == "enum" and drop_enums)
+                and not (
+                    key == "description" and nested and drop_nested_descriptions
+                )
+            ]
+
+        root = {}
+        # Each entry is (source, output, kept items of a dict source, whether
+        # the source is nested below the root, whether to flatten it). Lists
+        # are never flattened, nor is anything below them.
+        stack = [(endpoint, root, kept_items(endpoint, False), False, True)]
+
+        while stack:
+            source, output, items, nested, flatten = stack.pop()
+
+            if items is None:
+                for item in source:
+                    if isinstance(item, dict):
+                        child = {}
+                        stack.append((item, child, kept_items(item, True), True, False))
+                    elif isinstance(item, list):
+                        child = []
+                        stack.append((item, child, None, True, False))
+                    elif abbreviations is not None and isinstance(item, str):
+                        child = abbreviations.get(item.lower(), item.lower())
+                    else:
+                        child = item
+                    output.append(child)
+                continue
+
+            child_items = {}
+            if flatten:
+                entries = {}
+                for key, value in items:
+                    value_items = None
+                    if isinstance(value, dict):
+                        value_items = kept_items(value, True)
+                        if not (
+                            key in flatten_keep_keys
+                            or (
+                                isinstance(key, str)
+                                and (key.startswith("5") or key.startswith("4"))
+                            )
+                        ):
+                            while len(value_items) == 1:
+                                key, value = value_items[0]
+                                if not isinstance(value, dict):
+                                    value_items = None
+                                    break
+                                value_items = kept_items(value, True)
+                    entries[key] = value
+                    child_items[id(value)] = value_items
+                items = entries.items()
+
+            if abbreviations is not None:
+                items = {
+                    abbreviations.get(key.lower(), key.lower()): value
+                    for key, value in items
+                }.items()
+
+            for key, value in items:
+                if isinstance(value, dict):
+                    child = {}
+                    value_items = child_items.get(id(value))
+                    if value_items is None:
+                        value_items = kept_items(value, True)
+                    stack.append((value, child, value_items, True, flatten))
+                elif isinstance(value, list):
+                    child = []
+                    stack.append((value, child, None, True, False))
+                elif abbreviations is not None:
+                    child = abbreviations.get(str(value).lower(), value)
+                    if isinstance(child, str):
+                        child = abbreviations.get(child.lower(), child.lower())
+                else:
+                    child = value
+                output[key] = child
+
+        return root
+
     def remove_empty_keys(self, endpoint):
         if isinstance(endpoint, dict):
             new_endpoint = {}
@@ -218,7 +1016,8 @@ class OpenAPIMinifierService:
         else:
             return endpoint
 
-    def remove_unnecessary_keys(self, endpoint):
+    def remove_unnecessary_keys(self, endpoint, keys_to_keep=None):
+        keys_to_keep = keys_to_keep or self.keys_to_keep
         stack = [(endpoint, [])]
 
         while stack:
@@ -226,14 +1025,14 @@ class OpenAPIMinifierService:
 
             if isinstance(current_data, dict):
                 for k in list(current_data.keys()):
-                    if k == "example" and not self.keys_to_keep["examples"]:
+                    if k == "example" and not keys_to_keep["examples"]:
                         del current_data[k]
-                    if k == "enum" and not self.keys_to_keep["enums"]:
+                    if k == "enum" and not keys_to_keep["enums"]:
                         del current_data[k]
                     elif (
                         k == "description"
                         and len(parent_keys) > 0
-                        and not self.keys_to_keep["nested_descriptions"]
+                        and not keys_to_keep["nested_descriptions"]
                     ):
                         del current_data[k]
                     if k in current_data and isinstance(current_data[k], (dict, list)):
@@ -288,31 +1087,24 @@ class OpenAPIMinifierService:
     def create_endpoint_documents(self, minified_endpoints, open_api_spec):
         tag_summaries = self.get_tag_summaries(minified_endpoints, open_api_spec)
 
-        for endpoint in minified_endpoints:
-            tag = endpoint.get("tag") or "default"
-
-            tag_summary_list = [
-                summary for summary in tag_summaries if summary["name"] == tag
-            ]
-            tag_summary = tag_summary_list[0]["summary"] if tag_summary_list else ""
-            tag_number = tag_summary_list[0]["tag_number"] if tag_summary_list else 0
-
-            endpoint["tag_summary"] = tag_summary
-            endpoint["tag_number"] = tag_number
-
-            endpoint["doc_number"] = self.operationID_counter
-
-            parsed = urlparse(endpoint["server_url"])
-            if parsed.scheme and parsed.netloc:
-                endpoint["title"] = re.sub(
-                    r"https?://[^/]+/", "", endpoint["server_url"]
+        # Every endpoint of a tag shares one TagInfo instead of carrying its
+        # own copy of the summary and number.
+        tag_infos = {}
+        for summary in tag_summaries:
+            if summary["name"] not in tag_infos:
+                tag_infos[summary["name"]] = TagInfo(
+                    summary["name"], summary["summary"], summary["tag_number"]
                 )
 
-            else:
-                endpoint["title"] = endpoint["server_url"]
+        for endpoint in minified_endpoints:
+            tag = endpoint.tag or "default"
 
-            filename = f"{tag_number}_{endpoint['tag']}_{endpoint['operation_id']}_{self.operationID_counter}"
-            endpoint["filename"] = filename
+            tag_info = tag_infos.get(tag)
+            if tag_info is None:
+                tag_info = tag_infos[tag] = TagInfo(tag, "", 0)
+
+            endpoint.tag_info = tag_info
+            endpoint.doc_number = self.operationID_counter
 
             self.operationID_counter += 1
 
@@ -334,9 +1126,11 @@ class OpenAPIMinifierService:
                     else:
                         tag_summaries.append({"name": name, "summary": ""})
 
+        names = {t["name"] for t in tag_summaries}
         for endpoint in minified_endpoints:
-            tag = endpoint.get("tag") or "default"
-            if tag not in [t["name"] for t in tag_summaries]:
+            tag = endpoint.tag or "default"
+            if tag not in names:
+                names.add(tag)
                 tag_summaries.append({"name": tag, "summary": ""})
 
         tag_summaries = sorted(tag_summaries, key=lambda x: (x["name"]))
@@ -347,32 +1141,4 @@ class OpenAPIMinifierService:
         return tag_summaries
 
     def write_dict_to_text(self, data):
-        def remove_html_tags_and_punctuation(input_str):
-            no_html_str = re.sub("<.*?>", "", input_str)
-            modified_punctuation = set(string.punctuation) - {"/", "#"}
-            return (
-                "".join(ch for ch in no_html_str if ch not in modified_punctuation)
-                .lower()
-                .strip()
-            )
-
-        formatted_text_parts = []
-
-        if isinstance(data, dict):
-            for key, value in data.items():
-                key = remove_html_tags_and_punctuation(key)
-
-                if isinstance(value, (dict, list)):
-                    formatted_text_parts.append(key)
-                    formatted_text_parts.append(self.write_dict_to_text(value))
-                else:
-                    value = remove_html_tags_and_punctuation(str(value))
-                    formatted_text_parts.append(f"{key} {value}")
-        elif isinstance(data, list):
-            for item in data:
-                formatted_text_parts.append(self.write_dict_to_text(item))
-        else:
-            data = remove_html_tags_and_punctuation(str(data))
-            formatted_text_parts.append(data)
-
-        return "\n".join(filter(lambda x: x.strip(), formatted_text_parts))
\ No newline at end of file
+        return dict_to_text(data)
@@ -0,0 +1,325 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from collections import namedtuple
+from functools import lru_cache
+from typing import Any, List
+
+from llama_index.bridge.pydantic import PrivateAttr
+from llama_index.embeddings import OpenAIEmbedding
+from llama_index.embeddings.base import BaseEmbedding
+from llama_index.llms import OpenAI
+from llama_index.llms.base import llm_completion_callback
+from llama_index.llms.custom import CustomLLM
+from llama_index.llms.types import CompletionResponse, CompletionResponseGen, LLMMetadata
+
+from embedding import FakeEmbedding
+from tokenizer import approximate_token_count
+
+
+# Words with their leading whitespace, joined back they give the text.
+STREAM_TOKEN_RE = re.compile(r"\s*\S+|\s+")
+
+
+FAKE_WORDS = (
+    "the endpoint returns a list of resources filtered by status and paginated with a"
+    " cursor, callers authenticate with an API key and create, update or delete records"
+    " through the documented request bodies"
+).split()
+
+
+class FakeLLM(CustomLLM):
+    # Deterministic local completions for tests and benchmarks. Answers are
+    # picked from the prompt's hash, latency is the time to the first token
+    # and tokens_per_second paces the rest.
+    latency: float = 0.0
+    tokens_per_second: float = 0.0
+    output_tokens: int = 48
+    context_window: int = 16385
+    seed: int = 0
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(
+            context_window=self.context_window,
+            num_output=self.output_tokens,
+            model_name="fake",
+        )
+
+    def _tokens(self, prompt):
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode("utf-8")).digest()
+        rng = random.Random(digest)
+        words = [rng.choice(FAKE_WORDS) for _ in range(self.output_tokens)]
+        thought, answer = words[: len(words) // 4], words[len(words) // 4 :]
+        text = f"Thought: {' '.join(thought)}\nFinal Answer: {' '.join(answer)}."
+        return STREAM_TOKEN_RE.findall(text)
+
+    def _pace(self, tokens):
+        if self.tokens_per_second:
+            time.sleep(tokens / self.tokens_per_second)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        tokens = self._tokens(prompt)
+        time.sleep(self.latency)
+        self._pace(approximate_token_count("".join(tokens)))
+        return CompletionResponse(text="".join(tokens))
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        # CustomLLM would call complete() and block the event loop, a hosted
+        # model's client waits without blocking it.
+        tokens = self._tokens(prompt)
+        text = "".join(tokens)
+        pace = approximate_token_count(text) / self.tokens_per_second if self.tokens_per_second else 0.0
+        await asyncio.sleep(self.latency + pace)
+        return CompletionResponse(text=text)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, **kwargs: Any) -> CompletionResponseGen:
+        tokens = self._tokens(prompt)
+
+        def gen():
+            time.sleep(self.latency)
+            text = ""
+            for token in tokens:
+                self._pace(approximate_token_count(token))
+                text += token
+                yield CompletionResponse(text=text, delta=token)
+
+        return gen()
+
+
+class MissingRecordingError(KeyError):
+    pass
+
+
+class Recordings:
+    # Model responses keyed by a hash of their input, appended to a JSONL
+    # file as they come in. A key recorded twice keeps its last response.
+    def __init__(self, path):
+        self.path = path
+        self.entries = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def load(self):
+        entries = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    entries[entry["key"]] = entry["value"]
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def get(self, key):
+        with self.lock:
+            if self.entries is None:
+                self.entries = self.load()
+            try:
+                return self.entries[key]
+            except KeyError:
+                raise MissingRecordingError(f"No recorded response for {key} in {self.path}")
+
+    def put(self, items):
+        items = list(items)
+        with self.lock:
+            if self.entries is None:
+                self.entries = self.load()
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                for key, value in items:
+                    f.write(json.dumps({"key": key, "value": value}) + "\n")
+            self.entries.update(items)
+
+
+class RecordingLLM(CustomLLM):
+    # Wraps another LLM. "record" calls it and saves every response, "replay"
+    # answers from the saved responses only and never calls it.
+    mode: str = "replay"
+
+    _llm: Any = PrivateAttr()
+    _recordings: Recordings = PrivateAttr()
+
+    def __init__(self, llm, recordings, mode="replay", **kwargs):
+        super().__init__(mode=mode, **kwargs)
+        self._llm = llm
+        self._recordings = recordings
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RecordingLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        # Prompts are recorded as completions, so chat models are replayed
+        # with the same prompt whether or not the caller would chat.
+        return self._llm.metadata.copy(update={"is_chat_model": False})
+
+    def _key(self, prompt):
+        return self._recordings.key("complete", self._llm.metadata.model_name, prompt)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        key = self._key(prompt)
+        if self.mode == "replay":
+            return CompletionResponse(text=self._recordings.get(key))
+
+        text = self._llm.complete(prompt, **kwargs).text
+        self._recordings.put([(key, text)])
+        return CompletionResponse(text=text)
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        key = self._key(prompt)
+        if self.mode == "replay":
+            return CompletionResponse(text=self._recordings.get(key))
+
+        text = (await self._llm.acomplete(prompt, **kwargs)).text
+        self._recordings.put([(key, text)])
+        return CompletionResponse(text=text)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, **kwargs: Any) -> CompletionResponseGen:
+        key = self._key(prompt)
+        if self.mode == "replay":
+            recorded = self._recordings.get(key)
+
+            def replay():
+                text = ""
+                for token in STREAM_TOKEN_RE.findall(recorded):
+                    text += token
+                    yield CompletionResponse(text=text, delta=token)
+
+            return replay()
+
+        def record():
+            text = ""
+            for response in self._llm.stream_complete(prompt, **kwargs):
+                text = response.text
+                yield response
+            self._recordings.put([(key, text)])
+
+        return record()
+
+
+class RecordingEmbedding(BaseEmbedding):
+    mode: str = "replay"
+
+    _embed_model: Any = PrivateAttr()
+    _recordings: Recordings = PrivateAttr()
+
+    def __init__(self, embed_model, recordings, mode="replay", **kwargs):
+        super().__init__(
+            mode=mode,
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            **kwargs,
+        )
+        self._embed_model = embed_model
+        self._recordings = recordings
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RecordingEmbedding"
+
+    def _embeddings(self, kind, texts, embed):
+        keys = [self._recordings.key(kind, self.model_name, text) for text in texts]
+        if self.mode == "replay":
+            return [self._recordings.get(key) for key in keys]
+
+        embeddings = embed(texts)
+        self._recordings.put(zip(keys, embeddings))
+        return embeddings
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embeddings(
+            "query", [query], lambda texts: [self._embed_model._get_query_embedding(texts[0])]
+        )[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embeddings("text", texts, self._embed_model._get_text_embeddings)
+
+
+Models = namedtuple("Models", ["provider", "llm", "embed_model"])
+
+
+MODEL_PROVIDERS = {
+    "openai": lambda: (OpenAI(temperature=0.3), OpenAIEmbedding()),
+    "fake": lambda: (FakeLLM(), FakeEmbedding()),
+}
+
+# Providers whose models hold no network client and can be shared by every
+# run. The OpenAI models keep an async client bound to the event loop of
+# their first query, and each run queries from an event loop of its own.
+SHARED_PROVIDERS = {"fake"}
+
+
+@lru_cache(maxsize=None)
+def recordings(path):
+    # One per file, runs recording at the same time append through its lock.
+    return Recordings(path)
+
+
+def create_models(provider=None, recording=None, recordings_dir=None):
+    # MODEL_PROVIDER picks the models, MODEL_RECORDING=record or replay wraps
+    # them so their responses are saved to or served from MODEL_RECORDINGS_DIR.
+    provider = provider or os.environ.get("MODEL_PROVIDER", "openai")
+    recording = recording or os.environ.get("MODEL_RECORDING")
+    recordings_dir = recordings_dir or os.environ.get(
+        "MODEL_RECORDINGS_DIR", "./cache/recordings"
+    )
+
+    if provider not in MODEL_PROVIDERS:
+        raise ValueError(
+            f"Unknown model provider {provider!r}, expected one of {list(MODEL_PROVIDERS)}"
+        )
+    if recording and recording not in ("record", "replay"):
+        raise ValueError(f"Unknown recording mode {recording!r}, expected record or replay")
+
+    # Replayed models never call the provider.
+    if provider in SHARED_PROVIDERS or recording == "replay":
+        return shared_models(provider, recording, recordings_dir)
+    return build_models(provider, recording, recordings_dir)
+
+
+@lru_cache(maxsize=None)
+def shared_models(provider, recording, recordings_dir):
+    return build_models(provider, recording, recordings_dir)
+
+
+def build_models(provider, recording, recordings_dir):
+    llm, embed_model = MODEL_PROVIDERS[provider]()
+    if recording:
+        llm = RecordingLLM(
+            llm, recordings(os.path.join(recordings_dir, provider, "llm.jsonl")), recording
+        )
+        embed_model = RecordingEmbedding(
+            embed_model,
+            recordings(os.path.join(recordings_dir, provider, "embeddings.jsonl")),
+            recording,
+        )
+    return Models(provider, llm, embed_model)
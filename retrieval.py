@@ -0,0 +1,100 @@
+from typing import Any, Dict, List, Optional
+
+from llama_index.bridge.pydantic import Field
+from llama_index.postprocessor.types import BaseNodePostprocessor
+from llama_index.schema import NodeWithScore, QueryBundle, TextNode
+from llama_index.storage.docstore.types import BaseDocumentStore
+from llama_index.vector_stores.types import MetadataFilter, MetadataFilters
+
+
+class SchemaReferencePostprocessor(BaseNodePostprocessor):
+    # With deduplicated schemas an endpoint only names the component schemas
+    # it uses, so the referenced schema documents are pulled in next to it.
+    docstore: BaseDocumentStore = Field(exclude=True)
+    schema_doc_ids: Dict[str, str] = Field(default_factory=dict)
+    max_schemas: int = 8
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SchemaReferencePostprocessor"
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        seen_doc_ids = {node.node.ref_doc_id for node in nodes}
+
+        pending = []
+        for node in nodes:
+            pending.extend(node.node.metadata.get("schema_refs", ()))
+        pending.reverse()
+
+        added = []
+        schema_count = 0
+        while pending and schema_count < self.max_schemas:
+            doc_id = self.schema_doc_ids.get(pending.pop())
+            if doc_id is None or doc_id in seen_doc_ids:
+                continue
+            seen_doc_ids.add(doc_id)
+
+            ref_doc_info = self.docstore.get_ref_doc_info(doc_id)
+            if ref_doc_info is None:
+                continue
+            schema_count += 1
+
+            for schema_node in self.docstore.get_nodes(ref_doc_info.node_ids):
+                added.append(NodeWithScore(node=schema_node, score=None))
+                # Schemas referencing other schemas are followed breadth first.
+                pending[:0] = reversed(schema_node.metadata.get("schema_refs", ()))
+
+        return nodes + added
+
+
+class MaterializePostprocessor(BaseNodePostprocessor):
+    # In the lazy mode only catalog entries are indexed, the retrieved ones
+    # are swapped for the full minified documents before synthesis.
+    catalog: Any = Field(exclude=True)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MaterializePostprocessor"
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        materialized = []
+        for node in nodes:
+            metadata = node.node.metadata
+            document = self.catalog.document(metadata.get("method"), metadata.get("path"))
+            if document is None:
+                materialized.append(node)
+                continue
+
+            materialized.append(
+                NodeWithScore(
+                    node=TextNode(
+                        id_=node.node.node_id,
+                        text=document[1],
+                        metadata=metadata,
+                        excluded_embed_metadata_keys=node.node.excluded_embed_metadata_keys,
+                        excluded_llm_metadata_keys=node.node.excluded_llm_metadata_keys,
+                        relationships=node.node.relationships,
+                    ),
+                    score=node.score,
+                )
+            )
+        return materialized
+
+
+def metadata_filters(**values):
+    # Narrows retrieval to the documents whose metadata matches every given
+    # value, e.g. metadata_filters(method="get", tag="pets").
+    filters = [
+        MetadataFilter(key=key, value=value)
+        for key, value in values.items()
+        if value is not None
+    ]
+    return MetadataFilters(filters=filters) if filters else None
@@ -0,0 +1,123 @@
+import re
+import json
+import string
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
+
+
+HTML_TAG_RE = re.compile("<.*?>")
+PUNCTUATION_TABLE = str.maketrans("", "", "".join(set(string.punctuation) - {"/", "#"}))
+
+_DONE = object()
+
+
+@lru_cache(maxsize=8192)
+def clean_text(text):
+    if "<" in text:
+        text = HTML_TAG_RE.sub("", text)
+    return text.translate(PUNCTUATION_TABLE).lower().strip()
+
+
+def dict_to_text(data):
+    # Equivalent to joining every non-blank line of the nested structure with
+    # newlines, which is what the recursive version did one level at a time.
+    lines = []
+    stack = [(iter((data,)), False)]
+
+    while stack:
+        items, is_dict = stack[-1]
+        item = next(items, _DONE)
+        if item is _DONE:
+            stack.pop()
+            continue
+
+        if is_dict:
+            key, value = item
+            key = clean_text(key)
+            if isinstance(value, dict):
+                if key.strip():
+                    lines.append(key)
+                stack.append((iter(value.items()), True))
+                continue
+            if isinstance(value, list):
+                if key.strip():
+                    lines.append(key)
+                stack.append((iter(value), False))
+                continue
+            line = f"{key} {clean_text(str(value))}"
+        elif isinstance(item, dict):
+            stack.append((iter(item.items()), True))
+            continue
+        elif isinstance(item, list):
+            stack.append((iter(item), False))
+            continue
+        else:
+            line = clean_text(str(item))
+
+        if line.strip():
+            lines.append(line)
+
+    return "\n".join(lines)
+
+
+def encode_json_scalar(value):
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    return json.dumps(value)
+
+
+def encode_json_key(key):
+    if isinstance(key, str):
+        return encode_basestring_ascii(key)
+    if key is True:
+        return '"true"'
+    if key is False:
+        return '"false"'
+    if key is None:
+        return '"null"'
+    if isinstance(key, (int, float)):
+        return encode_basestring_ascii(json.dumps(key))
+    raise TypeError(f"keys must be str, int, float, bool or None, not {type(key).__name__}")
+
+
+def json_document_text(data, excluded_keys=()):
+    # Produces the lines json.dumps(data, indent=0) would, minus the ones that
+    # only hold brackets and commas, without building the dump first.
+    lines = []
+    entries = [(k, v) for k, v in data.items() if k not in excluded_keys]
+    stack = [(entries, 0, True)]
+
+    while stack:
+        entries, position, is_dict = stack.pop()
+        if position == len(entries):
+            continue
+        stack.append((entries, position + 1, is_dict))
+
+        if is_dict:
+            key, value = entries[position]
+            prefix = f"{encode_json_key(key)}: "
+        else:
+            value = entries[position]
+            prefix = ""
+        suffix = "," if position + 1 < len(entries) else ""
+
+        # Opening brackets of non-empty containers only make it into the text
+        # when a key precedes them, closing brackets never do.
+        if isinstance(value, dict):
+            if value:
+                if is_dict:
+                    lines.append(f"{prefix}{{")
+                stack.append((list(value.items()), 0, True))
+            elif is_dict:
+                lines.append(f"{prefix}{{}}{suffix}")
+        elif isinstance(value, list):
+            if value:
+                if is_dict:
+                    lines.append(f"{prefix}[")
+                stack.append((value, 0, False))
+            elif is_dict:
+                lines.append(f"{prefix}[]{suffix}")
+        else:
+            lines.append(f"{prefix}{encode_json_scalar(value)}{suffix}")
+
+    return "\n".join(lines)
@@ -0,0 +1,97 @@
+import os
+import json
+import pickle
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+from atomic_file import atomic_write
+
+
+def detect_format(content):
+    if isinstance(content, bytes):
+        content = content.decode("utf-8-sig")
+
+    stripped = content.lstrip()
+    if stripped[:1] in ("{", "["):
+        return "json"
+    return "yaml"
+
+
+def parse_spec(content, data_format=None):
+    if isinstance(content, bytes):
+        content = content.decode("utf-8-sig")
+
+    if (data_format or detect_format(content)) == "json":
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError:
+            # Flow-style YAML also starts with "{", let the YAML loader have a go.
+            pass
+
+    return yaml.load(content, Loader=SafeLoader)
+
+
+class ParsedSpecCache:
+    def __init__(self, cache_dir="./cache/parsed", max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def path(self, sha256):
+        return os.path.join(self.cache_dir, f"{sha256}.pickle")
+
+    def get(self, sha256):
+        path = self.path(sha256)
+        try:
+            with open(path, "rb") as f:
+                spec = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+        os.utime(path)
+        return spec
+
+    def put(self, sha256, spec):
+        atomic_write(
+            self.path(sha256), lambda f: pickle.dump(spec, f, protocol=pickle.HIGHEST_PROTOCOL)
+        )
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".pickle"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Evicted by a concurrent job.
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def load_spec(content, sha256=None, cache=None):
+    if cache is not None and sha256 is not None:
+        spec = cache.get(sha256)
+        if spec is not None:
+            return spec
+
+    spec = parse_spec(content)
+
+    if cache is not None and sha256 is not None:
+        cache.put(sha256, spec)
+    return spec
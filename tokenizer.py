@@ -0,0 +1,29 @@
+import re
+import logging
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def approximate_token_count(text):
+    return len(TOKEN_RE.findall(text))
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(encoding_name="cl100k_base"):
+    if tiktoken is not None:
+        try:
+            encoding = tiktoken.get_encoding(encoding_name)
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception as e:
+            # tiktoken downloads its vocabularies on first use.
+            logging.warning(f"Could not load the {encoding_name} encoding ({e!r})")
+
+    logging.warning("Counting tokens approximately, one per word or punctuation mark")
+    return approximate_token_count
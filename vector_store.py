@@ -0,0 +1,373 @@
+import os
+import json
+import threading
+from collections import defaultdict
+
+import numpy as np
+from llama_index.indices.query.embedding_utils import (
+    get_top_k_embeddings_learner,
+    get_top_k_mmr_embeddings,
+)
+from llama_index.vector_stores import SimpleVectorStore
+from llama_index.vector_stores.simple import _build_metadata_filter_fn
+from llama_index.vector_stores.types import (
+    FilterCondition,
+    FilterOperator,
+    VectorStore,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+
+from atomic_file import atomic_write
+
+
+INDEXED_METADATA_KEYS = ("method", "tag", "operation_id", "path")
+
+
+def metadata_postings(metadata_items):
+    postings = defaultdict(set)
+    for node_id, metadata in metadata_items:
+        for key in INDEXED_METADATA_KEYS:
+            value = metadata.get(key)
+            if value is not None:
+                postings[(key, value)].add(node_id)
+    return postings
+
+
+def filter_candidates(postings, filters):
+    # None means every node. Filters the postings cannot answer raise
+    # NotImplementedError so the caller can scan instead.
+    if filters is None or not filters.filters:
+        return None
+
+    matches = []
+    for filter_ in filters.filters:
+        operator = getattr(filter_, "operator", FilterOperator.EQ)
+        if filter_.key not in INDEXED_METADATA_KEYS:
+            raise NotImplementedError(filter_.key)
+        if operator != FilterOperator.EQ:
+            raise NotImplementedError(operator)
+        matches.append(postings.get((filter_.key, filter_.value), set()))
+
+    if filters.condition == FilterCondition.OR:
+        return set().union(*matches)
+    return set.intersection(*matches)
+
+
+def top_k(similarities, k):
+    k = min(k or len(similarities), len(similarities))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-similarities, k - 1)[:k]
+    return top[np.argsort(-similarities[top], kind="stable")]
+
+
+class MetadataIndexedVectorStore(SimpleVectorStore):
+    # Same data and persisted format as SimpleVectorStore, but equality
+    # filters on the indexed keys are answered from posting sets, and only
+    # the matching embeddings are scored, in one matrix product instead of
+    # one similarity call per node.
+    def __init__(self, data=None, fs=None, **kwargs):
+        super().__init__(data=data, fs=fs, **kwargs)
+        self._postings = None
+        self._matrix = None
+
+    def add(self, nodes, **add_kwargs):
+        self._postings = None
+        self._matrix = None
+        return super().add(nodes, **add_kwargs)
+
+    def delete(self, ref_doc_id, **delete_kwargs):
+        self._postings = None
+        self._matrix = None
+        super().delete(ref_doc_id, **delete_kwargs)
+
+    def postings(self):
+        if self._postings is None:
+            self._postings = metadata_postings(self._data.metadata_dict.items())
+        return self._postings
+
+    def matrix(self):
+        if self._matrix is None:
+            node_ids = list(self._data.embedding_dict)
+            matrix = np.array(
+                [self._data.embedding_dict[node_id] for node_id in node_ids],
+                dtype=np.float32,
+            ).reshape(len(node_ids), -1)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix /= np.where(norms == 0, 1, norms)
+            positions = {node_id: i for i, node_id in enumerate(node_ids)}
+            self._matrix = (node_ids, positions, matrix)
+        return self._matrix
+
+    def candidate_ids(self, filters):
+        return filter_candidates(self.postings(), filters)
+
+    def query(self, query, **kwargs):
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            return super().query(query, **kwargs)
+
+        try:
+            candidates = self.candidate_ids(query.filters)
+        except NotImplementedError:
+            return super().query(query, **kwargs)
+
+        if query.node_ids is not None:
+            node_ids = set(query.node_ids)
+            candidates = node_ids if candidates is None else candidates & node_ids
+
+        if not self._data.embedding_dict:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        node_ids, positions, matrix = self.matrix()
+        if candidates is not None:
+            rows = np.fromiter(
+                sorted(positions[node_id] for node_id in candidates if node_id in positions),
+                dtype=np.int64,
+            )
+            node_ids = [node_ids[row] for row in rows]
+            matrix = matrix[rows]
+
+        if not node_ids:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        query_embedding = np.asarray(query.query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query_embedding)
+        similarities = matrix @ (query_embedding / (query_norm or 1))
+
+        top = top_k(similarities, query.similarity_top_k)
+        return VectorStoreQueryResult(
+            similarities=[float(similarities[i]) for i in top],
+            ids=[node_ids[i] for i in top],
+        )
+
+
+class MmapVectorStore(VectorStore):
+    # Embeddings live in a float32 .npy file next to the persisted JSON and
+    # are memory-mapped on load, their norms in a second file. The JSON only
+    # holds the row aligned node ids, ref doc ids and node metadata. It is
+    # opened on load and parsed on first use, so like the mapped files it
+    # stays readable after its directory is replaced or removed. Nodes added
+    # after loading stay in memory and deleted rows are masked until the
+    # next persist rewrites the files. The async methods come from the
+    # VectorStore protocol and call the sync ones.
+    stores_text = False
+    is_embedding_query = True
+
+    def __init__(self, persist_path=None):
+        self.persist_path = persist_path
+        self._vectors = None
+        self._norms = None
+        self._rows = None
+        self._side_index = None
+        self._rows_lock = threading.Lock()
+        self._node_ids = None
+        self._added = []
+        self._added_matrix = None
+        self._deleted = set()
+        self._postings = None
+
+        if persist_path is not None:
+            base = os.path.splitext(persist_path)[0]
+            self._vectors = np.load(f"{base}.npy", mmap_mode="r")
+            self._norms = np.load(f"{base}.norms.npy", mmap_mode="r")
+            self._side_index = open(persist_path, "rb")
+
+    @staticmethod
+    def persisted(persist_path):
+        return os.path.exists(f"{os.path.splitext(persist_path)[0]}.npy")
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir, namespace="default"):
+        return cls(os.path.join(persist_dir, f"{namespace}__vector_store.json"))
+
+    @property
+    def client(self):
+        return None
+
+    def mapped_count(self):
+        return 0 if self._vectors is None else len(self._vectors)
+
+    def rows(self):
+        if self._rows is None:
+            with self._rows_lock:
+                if self._rows is None and self._side_index is None:
+                    self._rows = []
+                elif self._rows is None:
+                    with self._side_index as f:
+                        side_index = json.load(f)
+                    self._side_index = None
+                    self._rows = list(
+                        zip(side_index["ids"], side_index["ref_doc_ids"], side_index["metadata"])
+                    )
+        return self._rows
+
+    def node_ids(self):
+        if self._node_ids is None:
+            self._node_ids = [row[0] for row in self.rows()] + [entry[0] for entry in self._added]
+        return self._node_ids
+
+    def entries(self):
+        # Every live row as (row, node_id, ref_doc_id, metadata).
+        rows = self.rows() + [entry[:3] for entry in self._added]
+        for row, (node_id, ref_doc_id, metadata) in enumerate(rows):
+            if row not in self._deleted:
+                yield row, node_id, ref_doc_id, metadata
+
+    def postings(self):
+        if self._postings is None:
+            self._postings = metadata_postings(
+                (row, metadata) for row, _, _, metadata in self.entries()
+            )
+        return self._postings
+
+    def added_matrix(self):
+        if self._added_matrix is None:
+            vectors = np.asarray([entry[3] for entry in self._added], dtype=np.float32)
+            self._added_matrix = (vectors, np.linalg.norm(vectors, axis=-1))
+        return self._added_matrix
+
+    def vectors(self, rows):
+        mapped = self.mapped_count()
+        parts = []
+        if len(rows[rows < mapped]):
+            parts.append(np.asarray(self._vectors[rows[rows < mapped]]))
+        if len(rows[rows >= mapped]):
+            parts.append(self.added_matrix()[0][rows[rows >= mapped] - mapped])
+        return np.concatenate(parts)
+
+    def get(self, text_id):
+        row = self.node_ids().index(text_id)
+        return self.vectors(np.array([row]))[0].tolist()
+
+    def add(self, nodes, **add_kwargs):
+        for node in nodes:
+            self._added.append(
+                (node.node_id, node.ref_doc_id or "None", dict(node.metadata), node.get_embedding())
+            )
+        self._node_ids = None
+        self._added_matrix = None
+        self._postings = None
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id, **delete_kwargs):
+        for row, _, row_ref_doc_id, _ in list(self.entries()):
+            if row_ref_doc_id == ref_doc_id:
+                self._deleted.add(row)
+        self._postings = None
+
+    def similarities(self, query_embedding, rows=None):
+        # Cosine similarity with one matrix-vector product per part, rows
+        # that are deleted or have no norm come out as -inf.
+        mapped = self.mapped_count()
+        query_norm = np.linalg.norm(query_embedding) or 1
+        parts = []
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if mapped:
+                vectors, norms = self._vectors, self._norms
+                if rows is not None:
+                    vectors, norms = vectors[rows[rows < mapped]], norms[rows[rows < mapped]]
+                parts.append(np.asarray(vectors @ query_embedding) / (norms * query_norm))
+            if self._added:
+                vectors, norms = self.added_matrix()
+                if rows is not None:
+                    vectors, norms = vectors[rows[rows >= mapped] - mapped], norms[rows[rows >= mapped] - mapped]
+                parts.append((vectors @ query_embedding) / (norms * query_norm))
+
+        similarities = np.concatenate(parts) if parts else np.empty(0, dtype=np.float32)
+        similarities[~np.isfinite(similarities)] = -np.inf
+        if rows is None and self._deleted:
+            similarities[sorted(self._deleted)] = -np.inf
+        return similarities
+
+    def query(self, query, **kwargs):
+        node_ids = self.node_ids()
+        if not node_ids:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        try:
+            candidates = filter_candidates(self.postings(), query.filters)
+        except NotImplementedError:
+            filter_fn = _build_metadata_filter_fn(lambda metadata: metadata, query.filters)
+            candidates = {row for row, _, _, metadata in self.entries() if filter_fn(metadata)}
+        if query.node_ids is not None:
+            wanted = set(query.node_ids)
+            by_id = {row for row, node_id, _, _ in self.entries() if node_id in wanted}
+            candidates = by_id if candidates is None else candidates & by_id
+
+        rows = None
+        if candidates is not None:
+            rows = np.fromiter(sorted(candidates), dtype=np.int64)
+        elif query.mode != VectorStoreQueryMode.DEFAULT:
+            rows = np.fromiter((row for row, _, _, _ in self.entries()), dtype=np.int64)
+        if rows is not None and not len(rows):
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        query_embedding = np.asarray(query.query_embedding, dtype=np.float32)
+
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            embeddings = self.vectors(rows).tolist()
+            ids = [node_ids[row] for row in rows]
+            if query.mode == VectorStoreQueryMode.MMR:
+                similarities, ids = get_top_k_mmr_embeddings(
+                    query_embedding.tolist(),
+                    embeddings,
+                    similarity_top_k=query.similarity_top_k,
+                    embedding_ids=ids,
+                    mmr_threshold=kwargs.get("mmr_threshold"),
+                )
+            else:
+                similarities, ids = get_top_k_embeddings_learner(
+                    query_embedding.tolist(),
+                    embeddings,
+                    similarity_top_k=query.similarity_top_k,
+                    embedding_ids=ids,
+                    query_mode=query.mode,
+                )
+            return VectorStoreQueryResult(similarities=similarities, ids=ids)
+
+        similarities = self.similarities(query_embedding, rows)
+        top = top_k(similarities, query.similarity_top_k)
+        top = top[np.isfinite(similarities[top])]
+        result_rows = top if rows is None else rows[top]
+        return VectorStoreQueryResult(
+            similarities=[float(similarities[i]) for i in top],
+            ids=[node_ids[row] for row in result_rows],
+        )
+
+    def persist(self, persist_path, fs=None):
+        entries = list(self.entries())
+        rows = np.fromiter((entry[0] for entry in entries), dtype=np.int64)
+
+        if len(rows):
+            vectors = self.vectors(rows)
+        else:
+            dim = self._vectors.shape[1] if self._vectors is not None else 0
+            vectors = np.empty((0, dim), dtype=np.float32)
+
+        self.write(
+            persist_path,
+            vectors,
+            [entry[1] for entry in entries],
+            [entry[2] for entry in entries],
+            [entry[3] for entry in entries],
+        )
+
+    @staticmethod
+    def write(persist_path, vectors, ids, ref_doc_ids, metadata):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1).astype(np.float32)
+        side_index = {
+            "dim": vectors.shape[1],
+            "ids": ids,
+            "ref_doc_ids": ref_doc_ids,
+            "metadata": metadata,
+        }
+
+        # Each file is renamed into place, a store mapping the old files
+        # keeps reading them.
+        base = os.path.splitext(persist_path)[0]
+        atomic_write(f"{base}.npy", lambda f: np.save(f, vectors))
+        atomic_write(f"{base}.norms.npy", lambda f: np.save(f, norms))
+        atomic_write(persist_path, json.dumps(side_index))